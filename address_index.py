@@ -0,0 +1,214 @@
+"""Локальный нечёткий индекс адрес → кадастровый номер.
+
+Каждая разрешённая пара (адрес из ответа Росреестра и кадастровый номер)
+добавляется в индекс. Поиск по адресу сначала идёт сюда — триграммы
+нормализованного адреса и коэффициент Дайса — и только при промахе в API
+(fetch_reestr_data(..., "address")). Номера домов, корпусов и строений должны
+совпасть точно: «д 1» и «д 11» похожи по триграммам, но это разные объекты.
+
+Пары хранятся в SQLite (WAL), в памяти — триграммы адресов, сгруппированные
+по набору номеров: сходство считается только среди адресов с теми же номерами,
+поэтому поиск не зависит от размера индекса. Память догружается по
+возрастанию id, и пары, добавленные другими воркерами, подхватываются без
+полной перестройки.
+
+    python address_index.py --from-reestr-cache   # добавить пары из кэша Росреестра
+    python address_index.py --search "Москва, Тверская 1"
+"""
+from __future__ import annotations
+
+import os
+import re
+import json
+import sqlite3
+import logging
+import heapq
+import threading
+
+logger = logging.getLogger(__name__)
+
+ADDRESS_INDEX_PATH = os.getenv('ADDRESS_INDEX_PATH', '/tmp/bti-cache/address_index.sqlite3')
+# Порог сходства (Дайс по триграммам), ниже которого считается промахом
+ADDRESS_INDEX_MIN_SIMILARITY = float(os.getenv('ADDRESS_INDEX_MIN_SIMILARITY', '0.75'))
+
+# Сокращения адресных слов к одной форме
+_ABBREVIATIONS = {
+    'город': 'г', 'улица': 'ул', 'проспект': 'пр', 'пркт': 'пр', 'просп': 'пр', 'переулок': 'пер',
+    'шоссе': 'ш', 'бульвар': 'б', 'бр': 'б', 'бульв': 'б', 'набережная': 'наб', 'площадь': 'пл',
+    'проезд': 'прд', 'дом': 'д', 'корпус': 'к', 'корп': 'к', 'строение': 'с', 'стр': 'с',
+    'квартира': 'кв', 'помещение': 'пом', 'область': 'обл', 'район': 'р',
+}
+# Служебные слова, не различающие адреса
+_STOP_WORDS = {'г', 'обл', 'р', 'россия', 'рф', 'российская', 'федерация'}
+# Номер с буквой («10а») — один токен: «10а» и «10б» — разные дома
+_TOKEN_RE = re.compile(r'\d+[а-яa-z]?\b|[а-яa-z]+|\d+')
+
+
+def normalize_address(text: str) -> str:
+    """Нижний регистр, ё → е, без пунктуации, сокращения к одной форме, без индекса."""
+    tokens = []
+    for token in _TOKEN_RE.findall((text or '').lower().replace('ё', 'е')):
+        if token.isdigit() and len(token) == 6:
+            continue  # почтовый индекс
+        token = _ABBREVIATIONS.get(token, token)
+        if token not in _STOP_WORDS:
+            tokens.append(token)
+    return ' '.join(tokens)
+
+
+def _numbers(normalized: str) -> tuple:
+    return tuple(t for t in normalized.split() if t[0].isdigit())
+
+
+def _trigrams(normalized: str) -> set:
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class AddressIndex:
+    """Пары адрес → кадастровый номер с поиском по триграммам."""
+
+    def __init__(self, path: str = ADDRESS_INDEX_PATH, min_similarity: float = ADDRESS_INDEX_MIN_SIMILARITY):
+        self.min_similarity = min_similarity
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._buckets = {}   # номера адреса -> {id}
+        self._entries = {}   # id -> (нормализованный адрес, адрес, кадастровый номер, триграммы)
+        self._by_cadastral = {}  # кадастровый номер -> id
+        self._loaded_id = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS addresses (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "cadastral_number TEXT NOT NULL, address TEXT NOT NULL, normalized TEXT NOT NULL)"
+        )
+        self._refresh()
+
+    def _refresh(self) -> None:
+        """Догружает строки, добавленные после последней загрузки (в том числе другими воркерами)."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, cadastral_number, address, normalized FROM addresses WHERE id > ? ORDER BY id",
+                (self._loaded_id,)
+            ).fetchall()
+            for row_id, cadastral_number, address, normalized in rows:
+                self._index(row_id, cadastral_number, address, normalized)
+
+    def _index(self, row_id: int, cadastral_number: str, address: str, normalized: str) -> None:
+        # Новая строка по тому же номеру заменяет прежний адрес
+        previous = self._by_cadastral.pop(cadastral_number, None)
+        if previous is not None:
+            self._buckets[_numbers(self._entries.pop(previous)[0])].discard(previous)
+        self._buckets.setdefault(_numbers(normalized), set()).add(row_id)
+        self._entries[row_id] = (normalized, address, cadastral_number, frozenset(_trigrams(normalized)))
+        self._by_cadastral[cadastral_number] = row_id
+        self._loaded_id = max(self._loaded_id, row_id)
+
+    def add(self, address: str, cadastral_number: str) -> bool:
+        """Добавляет пару; False, если она уже в индексе."""
+        normalized = normalize_address(address)
+        if not normalized or not cadastral_number:
+            return False
+        with self._lock:
+            known = self._by_cadastral.get(cadastral_number)
+            if known is not None and self._entries[known][0] == normalized:
+                return False
+            self._conn.execute(
+                "INSERT INTO addresses (cadastral_number, address, normalized) VALUES (?, ?, ?)",
+                (cadastral_number, address, normalized)
+            )
+        self._refresh()
+        return True
+
+    def search(self, query: str, limit: int = 3) -> list:
+        """[(сходство, адрес, кадастровый номер)] по убыванию сходства, номера домов совпадают."""
+        normalized = normalize_address(query)
+        if not normalized:
+            return []
+        self._refresh()
+        grams = _trigrams(normalized)
+        with self._lock:
+            results = []
+            for row_id in self._buckets.get(_numbers(normalized), ()):
+                _, address, cadastral_number, entry_grams = self._entries[row_id]
+                score = 2 * len(grams & entry_grams) / (len(grams) + len(entry_grams))
+                results.append((round(score, 3), address, cadastral_number))
+        return heapq.nlargest(limit, results)
+
+    def lookup(self, query: str) -> str | None:
+        """Кадастровый номер лучшего совпадения не ниже min_similarity."""
+        results = self.search(query, limit=1)
+        hit = results[0][2] if results and results[0][0] >= self.min_similarity else None
+        with self._lock:
+            if hit is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return hit
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 3) if total else 0.0,
+            }
+
+
+_address_index = None
+_address_index_lock = threading.Lock()
+
+
+def get_address_index():
+    """Ленивая инициализация индекса адресов; None, если диск недоступен."""
+    global _address_index
+    if _address_index is None:
+        with _address_index_lock:
+            if _address_index is None:
+                try:
+                    _address_index = AddressIndex()
+                except Exception as e:
+                    logger.warning(f"Address index disabled: {e}")
+                    return None
+    return _address_index
+
+
+def address_index_stats() -> dict | None:
+    index = get_address_index()
+    return index.stats() if index is not None else None
+
+
+def import_reestr_cache(index: AddressIndex) -> int:
+    """Добавляет пары из дискового кэша Росреестра (caches.REESTR_CACHE_PATH)."""
+    from caches import REESTR_CACHE_PATH
+    conn = sqlite3.connect(REESTR_CACHE_PATH, timeout=5)
+    try:
+        rows = conn.execute("SELECT value FROM reestr").fetchall()
+    finally:
+        conn.close()
+    added = 0
+    for (value,) in rows:
+        data = json.loads(value)
+        if isinstance(data, dict) and data.get('address') and data.get('cadastral_number'):
+            added += index.add(data['address'], str(data['cadastral_number']))
+    return added
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Индекс адрес → кадастровый номер")
+    parser.add_argument('--from-reestr-cache', action='store_true', help='добавить пары из кэша Росреестра')
+    parser.add_argument('--search', help='найти адрес')
+    args = parser.parse_args()
+    index = AddressIndex()
+    if args.from_reestr_cache:
+        print(f"added: {import_reestr_cache(index)}")
+    if args.search:
+        print(json.dumps(index.search(args.search), ensure_ascii=False, indent=2))
+    print(json.dumps(index.stats(), ensure_ascii=False))
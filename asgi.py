@@ -0,0 +1,131 @@
+"""ASGI-вход для main.py: PTB Application работает прямо на event loop сервера.
+
+В WSGI-варианте (app.py) поток Flask передаёт апдейт в отдельный поток
+bot-event-loop и ждёт результата. Здесь вебхук — корутина на том же loop, что и
+бот: нет перехода между потоками и нет занятых потоков на время расчёта, поэтому
+один воркер держит сотни расчётов одновременно (блокирующие интеграции по-прежнему
+идут в пул offload.run_blocking, см. BLOCKING_IO_WORKERS).
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8080
+    gunicorn -k uvicorn.workers.UvicornWorker --workers 2 asgi:app
+
+Маршруты: POST / (вебхук), GET /health, GET /metrics. /batch есть только во Flask-приложении.
+"""
+import json
+import asyncio
+import logging
+
+import main
+from metrics import render as render_metrics
+from update_queue import UpdateQueue, WEBHOOK_ASYNC_ACK
+
+logger = logging.getLogger(__name__)
+
+_init_lock = None
+
+
+async def _ensure_bot() -> bool:
+    """Создаёт и запускает Application на текущем loop при первом апдейте."""
+    global _init_lock
+    if main.application is not None:
+        return True
+    if _init_lock is None:
+        _init_lock = asyncio.Lock()
+    async with _init_lock:
+        if main.application is not None:
+            return True
+        bot_app = main.build_application()
+        if bot_app is None:
+            return False
+        await bot_app.initialize()
+        await bot_app.start()
+        if WEBHOOK_ASYNC_ACK and main.update_queue is None:
+            queue = UpdateQueue(asyncio.get_running_loop(), bot_app.process_update)
+            await queue.start_async()
+            main.update_queue = queue
+        main.application = bot_app
+        logger.info("Bot initialized and started on the ASGI server loop")
+    return True
+
+
+async def _shutdown_bot() -> None:
+    bot_app = main.application
+    if bot_app is None:
+        return
+    try:
+        await bot_app.stop()
+        await bot_app.shutdown()
+    except Exception as e:
+        logger.warning(f"Bot shutdown error: {e}")
+
+
+async def _webhook(body: bytes) -> tuple:
+    if not await _ensure_bot():
+        return 500, {"error": "init failed"}
+    try:
+        upd = json.loads(body or b'null')
+    except ValueError:
+        return 400, {"error": "invalid JSON"}
+    if not upd or 'update_id' not in upd:
+        return 200, {"status": "OK"}
+    from telegram import Update
+    update = Update.de_json(upd, main.application.bot)
+    if update and main.update_queue is not None:
+        if not main.update_queue.submit_nowait(update):
+            return 503, {"error": "queue full"}
+    elif update:
+        await main.application.process_update(update)
+    return 200, {"status": "OK"}
+
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def _respond(send, status: int, body: bytes, content_type: str = 'application/json') -> None:
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type.encode()), (b'content-length', str(len(body)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _lifespan(receive, send) -> None:
+    # Бот поднимается лениво при первом апдейте — старт процесса не ждёт Telegram
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await _shutdown_bot()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+    path, method = scope['path'], scope['method']
+    try:
+        if path == '/' and method == 'POST':
+            status, payload = await _webhook(await _read_body(receive))
+        elif path == '/health' and method == 'GET':
+            status, payload = 200, main.health_payload()
+        elif path == '/metrics' and method == 'GET':
+            await _respond(send, 200, render_metrics().encode(), 'text/plain; version=0.0.4; charset=utf-8')
+            return
+        else:
+            status, payload = 404, {"error": "not found"}
+    except Exception as e:
+        logger.error(f"Error in ASGI request {method} {path}: {e}")
+        status, payload = 500, {"error": str(e)}
+    await _respond(send, status, json.dumps(payload, ensure_ascii=False).encode('utf-8'))
@@ -0,0 +1,121 @@
+"""Бенчмарк локального снимка кадастровых объектов (cadastral_snapshot).
+
+Собирает снимок из синтетических записей (регионы 77, 78, 50), открывает его
+через mmap и меряет время поиска попаданий и промахов, размер файла и прирост
+RSS после серии поисков — отдельно собственной памяти процесса и страниц файла.
+Найденные записи сверяются с исходными.
+
+    python benchmarks/bench_cadastral_snapshot.py [--objects 1000000] [--lookups 200000] [--json results.json]
+
+Код выхода 1, если хоть одна запись не совпала.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cadastral_snapshot import CadastralSnapshot, build_snapshot  # noqa: E402
+
+ROOM_TYPES = ["Квартира", "Нежилое помещение", "Жилое помещение", "Машино-место"]
+MATERIALS = ["Кирпичные", "Панельные", "Монолитные", "Блочные", "Деревянные"]
+
+
+def rss_kb() -> dict:
+    """RssAnon — собственная память процесса, RssFile — страницы файла в page cache."""
+    rss = {}
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(('RssAnon:', 'RssFile:')):
+                    name, value = line.split()[:2]
+                    rss[name.rstrip(':')] = int(value)
+    except OSError:
+        pass
+    return rss
+
+
+def synthetic_records(n: int, rnd: random.Random) -> list:
+    records = []
+    for i in range(n):
+        region = rnd.choice(("77", "78", "50"))
+        records.append({
+            "cadastral_number": f"{region}:{rnd.randint(1, 30):02d}:{rnd.randint(1, 99999):07d}:{i % 9999 + 1}",
+            "address": f"г. Москва, ул. Тестовая, д. {i % 300 + 1}, кв. {i % 500 + 1}",
+            "area": round(rnd.uniform(12, 250), 1),
+            "build_year": rnd.randint(1900, 2024),
+            "materials": rnd.choice(MATERIALS),
+            "room_type": rnd.choice(ROOM_TYPES),
+        })
+    return records
+
+
+def timed_lookups(snapshot: CadastralSnapshot, numbers: list) -> float:
+    started = time.perf_counter()
+    for number in numbers:
+        snapshot.get(number)
+    return (time.perf_counter() - started) / len(numbers) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--objects', type=int, default=1_000_000)
+    parser.add_argument('--lookups', type=int, default=200_000)
+    parser.add_argument('--json', dest='json_path', help='куда записать результаты')
+    args = parser.parse_args()
+
+    rnd = random.Random(42)
+    records = synthetic_records(args.objects, rnd)
+    expected = {r["cadastral_number"]: r for r in records}
+    with tempfile.TemporaryDirectory(prefix="bench-snapshot-") as tmp:
+        path = os.path.join(tmp, "cadastral.snapshot")
+        started = time.perf_counter()
+        count = build_snapshot(records, path)
+        build_sec = time.perf_counter() - started
+        del records
+
+        numbers = list(expected)
+        hits = [rnd.choice(numbers) for _ in range(args.lookups)]
+        misses = [f"77:01:{rnd.randint(100000, 999999):07d}:{rnd.randint(10000, 99999)}" for _ in range(args.lookups)]
+        rss_before = rss_kb()
+        started = time.perf_counter()
+        snapshot = CadastralSnapshot(path)
+        open_ms = (time.perf_counter() - started) * 1000
+        hit_us = timed_lookups(snapshot, hits)
+        miss_us = timed_lookups(snapshot, misses)
+        rss_after = rss_kb()
+
+        mismatches = 0
+        for number in hits[:10_000]:
+            got, want = snapshot.get(number), expected[number]
+            if (got is None or got["address"] != want["address"] or got["build_year"] != want["build_year"]
+                    or got["room_type"] != want["room_type"] or got["materials"] != want["materials"]
+                    or abs(got["area"] - want["area"]) > 0.01):
+                mismatches += 1
+
+        results = {
+            "objects": count,
+            "file_bytes": os.path.getsize(path),
+            "bytes_per_object": round(os.path.getsize(path) / max(count, 1), 1),
+            "build_sec": round(build_sec, 2),
+            "open_ms": round(open_ms, 3),
+            "hit_us": round(hit_us, 2),
+            "miss_us": round(miss_us, 2),
+            "rss_delta_kb": {name: rss_after.get(name, 0) - value for name, value in rss_before.items()},
+            "mismatches": mismatches,
+            "stats": snapshot.stats(),
+        }
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Проверка, что блокирующие интеграции не замораживают event loop бота.
+
+Запускает message_handler из main.py для одного расчёта, затем для нескольких
+одновременных. Росреестр, SERP и GPT подменяются заглушками с задержкой
+time.sleep. Если обработчики не блокируют loop, N расчётов идут примерно
+столько же, сколько один.
+
+    python benchmarks/bench_concurrent_quotes.py [--delay 0.3] [--users 2]
+
+Код выхода 1, если параллельный прогон дольше одиночного более чем в --max-ratio раз.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import main  # noqa: E402
+
+
+class _FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+
+
+class _FakeMessage:
+    def __init__(self, text: str):
+        self.text = text
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+        return self
+
+    async def edit_text(self, text, **kwargs):
+        # Прогрессивный режим (по умолчанию) правит одно статусное сообщение
+        self.replies[-1] = text
+        return self
+
+
+class _FakeUpdate:
+    def __init__(self, user_id: int, text: str):
+        self.effective_user = _FakeUser(user_id)
+        self.message = _FakeMessage(text)
+
+
+def _install_stubs(delay: float) -> None:
+    def fetch_reestr_data(query, search_type="cadastral"):
+        time.sleep(delay)
+        return {"address": "Москва, ул. Тестовая, д. 1", "cadastral_number": query, "area": 120.0,
+                "build_year": 1990, "materials": "Кирпич", "room_type": "Нежилое"}
+
+    def search_competitor_prices(address, area, index_keys=()):
+        time.sleep(delay)
+        return [120, 150, 180]
+
+    def generate_commercial_proposal(*args, **kwargs):
+        time.sleep(delay)
+        return "КП"
+
+    main.fetch_reestr_data = fetch_reestr_data
+    main.search_competitor_prices = search_competitor_prices
+    main.generate_commercial_proposal = generate_commercial_proposal
+
+
+async def _run(users: int) -> float:
+    updates = [_FakeUpdate(1000 + i, f"77:09:0001013:{1000 + i}") for i in range(users)]
+    started = time.perf_counter()
+    await asyncio.gather(*(main.message_handler(u, None) for u in updates))
+    return time.perf_counter() - started
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--delay', type=float, default=0.3, help='задержка каждой заглушки, c')
+    parser.add_argument('--users', type=int, default=2)
+    parser.add_argument('--max-ratio', type=float, default=1.5)
+    args = parser.parse_args()
+
+    _install_stubs(args.delay)
+    single = asyncio.run(_run(1))
+    concurrent = asyncio.run(_run(args.users))
+    ratio = concurrent / single
+    print(json.dumps({"users": args.users, "single_sec": round(single, 3),
+                      "concurrent_sec": round(concurrent, 3), "ratio": round(ratio, 2)}, indent=2))
+    sys.exit(0 if ratio <= args.max_ratio else 1)
+
+
+if __name__ == '__main__':
+    main_cli()
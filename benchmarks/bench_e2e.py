@@ -0,0 +1,277 @@
+"""Сквозной бенчмарк бота на локальных заглушках Росреестра, SERP, OpenAI и Telegram.
+
+Поднимает заглушки (benchmarks/stub_upstreams.py) с профилем задержек и ошибок,
+затем для каждой цели (main, main_fixed) в отдельном процессе гоняет webhook()
+через Flask test client синтетическими апдейтами Telegram:
+
+* main       — одно сообщение с кадастровым номером (весь расчёт + КП),
+               в прогрессивном режиме (одно сообщение правится) и в классическом
+               (PROGRESSIVE_QUOTE_MESSAGE=0, отдельное сообщение на каждый шаг);
+* main_fixed — сообщение → verify_yes → generate_proposal.
+
+Считает p50/p95/p99 по этапам (Росреестр, SERP, парсинг цен, расчёт, GPT,
+Telegram), по апдейтам и по расчёту целиком, пропускную способность и число
+вызовов Bot API на расчёт.
+
+    python benchmarks/bench_e2e.py [--targets main main_fixed] [--quote-modes progressive classic]
+        [--quotes 50] [--concurrency 4] [--buildings 20] [--profile realistic] [--json results.json]
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+import subprocess
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(ROOT))
+sys.path.insert(0, ROOT)
+
+STAGES = {
+    # этап -> функции модуля, время которых к нему относится
+    "main": {
+        "reestr": ["lookup_reestr_data"],
+        "serp": ["_serp_query"],
+        "price_parse": ["parse_competitor_prices"],
+        "pricing": ["calc_bti", "calc_competitors", "calc_recommended"],
+        "gpt": ["generate_commercial_proposal"],
+    },
+    "main_fixed": {
+        "reestr": ["fetch_reestr_data"],
+        "serp": ["_serp_query"],
+        "price_parse": ["parse_competitor_prices"],
+        "pricing": ["calculate_bti_prices", "calculate_competitor_prices", "calculate_recommended_price"],
+        "gpt": ["generate_commercial_proposal", "stream_commercial_proposal"],
+    },
+}
+
+
+def percentiles(values: list) -> dict:
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def rank(q):
+        return ordered[min(len(ordered) - 1, max(0, int(round(q * len(ordered) + 0.5)) - 1))]
+
+    return {
+        "count": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+        "p50_ms": round(rank(0.50) * 1000, 2),
+        "p95_ms": round(rank(0.95) * 1000, 2),
+        "p99_ms": round(rank(0.99) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+
+class StageRecorder:
+    def __init__(self):
+        self.samples = {}
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, elapsed: float) -> None:
+        with self._lock:
+            self.samples.setdefault(stage, []).append(elapsed)
+
+    def count(self, key: str) -> None:
+        with self._lock:
+            self.calls[key] = self.calls.get(key, 0) + 1
+
+    def wrap(self, stage: str, func):
+        import inspect
+        recorder = self
+
+        if inspect.isasyncgenfunction(func):
+            async def timed_gen(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    async for item in func(*args, **kwargs):
+                        yield item
+                finally:
+                    recorder.add(stage, time.perf_counter() - started)
+            return timed_gen
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                recorder.add(stage, time.perf_counter() - started)
+        return timed
+
+
+def _instrument(module, target: str, recorder: StageRecorder) -> None:
+    for stage, names in STAGES[target].items():
+        for name in names:
+            setattr(module, name, recorder.wrap(stage, getattr(module, name)))
+
+    # Telegram: каждый HTTP-вызов Bot API
+    from telegram.request import HTTPXRequest
+    original = HTTPXRequest.do_request
+
+    async def do_request(self, url, method, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await original(self, url, method, *args, **kwargs)
+        finally:
+            recorder.add("telegram", time.perf_counter() - started)
+            recorder.count(url.rsplit('/', 1)[-1])
+
+    HTTPXRequest.do_request = do_request
+
+
+def _user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"Bench{user_id}"}
+
+
+def _message_update(update_id: int, user_id: int, text: str) -> dict:
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(time.time()), "from": _user(user_id),
+        "chat": {"id": user_id, "type": "private"}, "text": text,
+    }}
+
+
+def _callback_update(update_id: int, user_id: int, data: str) -> dict:
+    return {"update_id": update_id, "callback_query": {
+        "id": str(update_id), "from": _user(user_id), "chat_instance": str(user_id), "data": data,
+        "message": {"message_id": update_id, "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"}, "text": "..."},
+    }}
+
+
+def _scenario(target: str, quote_no: int, buildings: int) -> list:
+    user_id = 10_000 + quote_no
+    cadastral = f"77:09:0001013:{1000 + quote_no % buildings}"
+    base = quote_no * 10
+    updates = [_message_update(base, user_id, cadastral)]
+    if target == "main_fixed":
+        updates.append(_callback_update(base + 1, user_id, "verify_yes"))
+        updates.append(_callback_update(base + 2, user_id, "generate_proposal"))
+    return updates
+
+
+def run_worker(target: str, quotes: int, concurrency: int, buildings: int) -> dict:
+    """Выполняется в дочернем процессе: импорт цели, инструментирование, прогон."""
+    import importlib
+    module = importlib.import_module(target)
+    recorder = StageRecorder()
+    _instrument(module, target, recorder)
+    update_latency, quote_latency, errors = [], [], []
+
+    def run_quote(quote_no: int) -> None:
+        client = module.app.test_client()
+        started = time.perf_counter()
+        for update in _scenario(target, quote_no, buildings):
+            t0 = time.perf_counter()
+            resp = client.post('/', json=update)
+            update_latency.append(time.perf_counter() - t0)
+            if resp.status_code != 200:
+                errors.append(resp.status_code)
+        quote_latency.append(time.perf_counter() - started)
+
+    # Прогрев: инициализация бота (getMe) не входит в замер
+    module.app.test_client().post('/', json={"update_id": 0})
+    recorder.samples.clear()
+    recorder.calls.clear()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(run_quote, range(1, quotes + 1)))
+    wall = time.perf_counter() - started
+
+    return {
+        "quotes": quotes,
+        "updates": len(update_latency),
+        "concurrency": concurrency,
+        "wall_sec": round(wall, 3),
+        "throughput_quotes_per_sec": round(quotes / wall, 3),
+        "throughput_updates_per_sec": round(len(update_latency) / wall, 3),
+        "webhook_errors": len(errors),
+        "quote": percentiles(quote_latency),
+        "update": percentiles(update_latency),
+        "stages": {stage: percentiles(values) for stage, values in sorted(recorder.samples.items())},
+        "telegram_calls": dict(sorted(recorder.calls.items())),
+        "telegram_calls_per_quote": round(sum(recorder.calls.values()) / quotes, 2),
+    }
+
+
+# Режимы сообщений main.py: значение PROGRESSIVE_QUOTE_MESSAGE
+QUOTE_MODES = {"progressive": "1", "classic": "0"}
+
+
+def run_target(target: str, args, stubs: dict, extra_env: dict = None) -> dict:
+    from stub_upstreams import stub_env
+    for stub in stubs.values():
+        stub.requests.clear()
+    with tempfile.TemporaryDirectory(prefix=f"bench-{target}-") as tmp:
+        env = {**os.environ, **stub_env(stubs), **(extra_env or {}),
+               "REESTR_CACHE_PATH": os.path.join(tmp, "reestr.sqlite3"),
+               "SESSION_DB_PATH": os.path.join(tmp, "sessions.sqlite3"),
+               # Индексы и кэши на диске не переживают прогон: иначе следующий
+               # режим или запуск отвечает из них без апстримов
+               "PRICE_INDEX_PATH": os.path.join(tmp, "price_index.sqlite3"),
+               "ADDRESS_INDEX_PATH": os.path.join(tmp, "address_index.sqlite3"),
+               "PDF_CACHE_DIR": os.path.join(tmp, "pdf"),
+               "CADASTRAL_SNAPSHOT_PATH": os.path.join(tmp, "cadastral.snapshot"),
+               "PYTHONPATH": os.path.dirname(ROOT)}
+        cmd = [sys.executable, os.path.abspath(__file__), "--worker", target,
+               "--quotes", str(args.quotes), "--concurrency", str(args.concurrency),
+               "--buildings", str(args.buildings)]
+        proc = subprocess.run(cmd, env=env, cwd=os.path.dirname(ROOT), capture_output=True, text=True)
+    if proc.returncode != 0:
+        return {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit {proc.returncode}"}
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["upstreams"] = {name: stub.summary() for name, stub in stubs.items()}
+    return result
+
+
+def main_cli():
+    from stub_upstreams import PROFILES, start_stubs
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--targets', nargs='+', default=['main', 'main_fixed'], choices=sorted(STAGES))
+    parser.add_argument('--quote-modes', nargs='+', default=sorted(QUOTE_MODES, reverse=True),
+                        choices=sorted(QUOTE_MODES), help='режимы сообщений для main')
+    parser.add_argument('--quotes', type=int, default=50, help='число расчётов (сценариев) на цель')
+    parser.add_argument('--concurrency', type=int, default=4, help='одновременных пользователей')
+    parser.add_argument('--buildings', type=int, default=20, help='различных кадастровых номеров')
+    parser.add_argument('--profile', default='realistic', choices=sorted(PROFILES))
+    parser.add_argument('--json', dest='json_path', help='куда записать результаты')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker, args.quotes, args.concurrency, args.buildings)))
+        return
+
+    stubs = start_stubs(PROFILES[args.profile])
+    try:
+        targets = {}
+        for target in args.targets:
+            if target != "main":
+                targets[target] = run_target(target, args, stubs)
+                continue
+            for mode in args.quote_modes:
+                targets[f"main[{mode}]"] = run_target(
+                    target, args, stubs, {"PROGRESSIVE_QUOTE_MESSAGE": QUOTE_MODES[mode]})
+        results = {
+            "profile": args.profile,
+            "latency_profile": PROFILES[args.profile],
+            "targets": targets,
+        }
+    finally:
+        for stub in stubs.values():
+            stub.stop()
+
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,92 @@
+"""Профиль холодного импорта main.py / main_fixed.py с бюджетом для CI.
+
+Каждый прогон — отдельный процесс `python -X importtime -c "import <target>"`
+без секретов в окружении. Отчёт: время импорта цели (медиана по --repeat),
+самые дорогие модули и пакеты верхнего уровня. Пакеты из --forbid (по умолчанию
+telegram, openai, requests) не должны загружаться при импорте: они подгружаются
+при первом апдейте / запросе.
+
+    python benchmarks/bench_import_time.py [--targets main main_fixed] [--repeat 5]
+        [--budget-ms 400] [--top 15] [--json import_profile.json]
+
+Код выхода 1, если импорт дольше --budget-ms или загружен запрещённый пакет.
+"""
+import os
+import sys
+import json
+import statistics
+import subprocess
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SECRET_VARS = ('BOT_TOKEN', 'OPENAI_API_KEY', 'REESTR_API_TOKEN', 'SERPRIVER_API_KEY')
+
+
+def profile_import(target: str) -> dict:
+    """Один холодный импорт: {модуль: (self_us, cumulative_us)} и время цели."""
+    env = {k: v for k, v in os.environ.items() if k not in SECRET_VARS}
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {target}'],
+                          cwd=ROOT, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    modules = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return {"total_us": modules[target][1], "modules": modules}
+
+
+def summarize(target: str, runs: list, top: int, forbid: list) -> dict:
+    last = runs[-1]["modules"]
+    packages = {}
+    for name, (self_us, _) in last.items():
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0) + self_us
+    loaded_forbidden = sorted({name.split('.')[0] for name in last} & set(forbid))
+    return {
+        "import_ms": round(statistics.median(r["total_us"] for r in runs) / 1000, 2),
+        "import_ms_runs": [round(r["total_us"] / 1000, 2) for r in runs],
+        "modules_loaded": len(last),
+        "top_modules_cumulative_ms": {
+            name: round(cum / 1000, 2)
+            for name, (_, cum) in sorted(last.items(), key=lambda kv: -kv[1][1])[:top]
+        },
+        "top_packages_self_ms": {
+            name: round(us / 1000, 2) for name, us in sorted(packages.items(), key=lambda kv: -kv[1])[:top]
+        },
+        "forbidden_loaded": loaded_forbidden,
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--targets', nargs='+', default=['main', 'main_fixed'])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=400.0, help='бюджет импорта одной цели, мс')
+    parser.add_argument('--forbid', nargs='*', default=['telegram', 'openai', 'requests'],
+                        help='пакеты, которые не должны загружаться при импорте')
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--json', dest='json_path', help='куда записать отчёт')
+    args = parser.parse_args()
+
+    results = {"budget_ms": args.budget_ms, "targets": {}}
+    failed = False
+    for target in args.targets:
+        runs = [profile_import(target) for _ in range(args.repeat)]
+        summary = summarize(target, runs, args.top, args.forbid)
+        summary["over_budget"] = summary["import_ms"] > args.budget_ms
+        failed = failed or summary["over_budget"] or bool(summary["forbidden_loaded"])
+        results["targets"][target] = summary
+
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,100 @@
+"""Микро-бенчмарк парсинга цен из сниппетов SERP.
+
+Сравнивает прежний разбор (10 паттернов через re.findall) с однопроходным
+price_parser.extract_prices на сохранённом корпусе benchmarks/data/serp_snippets.jsonl.
+
+    python benchmarks/bench_price_parser.py [--repeat 200] [--json results.json]
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from price_parser import extract_prices  # noqa: E402
+
+CORPUS_PATH = os.path.join(ROOT, 'benchmarks', 'data', 'serp_snippets.jsonl')
+
+# Паттерны из прежней версии parse_competitor_prices (main_fixed.py)
+LEGACY_PATTERNS = [
+    r'(\d+)\s*руб[./]?\s*м[²2]',
+    r'(\d+)\s*руб[./]?\s*кв[./]?м',
+    r'(\d+)\s*руб[./]?\s*за\s*м[²2]',
+    r'от\s*(\d+)\s*руб',
+    r'(\d+)\s*руб[./]?\s*м²',
+    r'(\d+)\s*руб[./]?\s*за\s*кв[./]?м',
+    r'стоимость[:\s]*(\d+)\s*руб',
+    r'цена[:\s]*(\d+)\s*руб',
+    r'(\d+)\s*руб[./]?\s*за\s*м²',
+    r'от\s*(\d+)\s*руб[./]?\s*м²'
+]
+
+
+def legacy_parse(texts: list) -> list:
+    prices = []
+    for text in texts:
+        for pattern in LEGACY_PATTERNS:
+            for match in re.findall(pattern, text):
+                price = int(match)
+                if 50 <= price <= 800:
+                    prices.append(price)
+    return prices
+
+
+def single_pass_parse(texts: list) -> list:
+    prices = []
+    for text in texts:
+        prices.extend(extract_prices(text, 50, 800))
+    return prices
+
+
+def load_corpus(path: str = CORPUS_PATH) -> list:
+    texts = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                texts.append(f"{item.get('title', '')} {item.get('snippet', '')}".lower())
+    return texts
+
+
+def run(parse, texts: list, repeat: int) -> dict:
+    found = len(parse(texts))
+    started = time.perf_counter()
+    for _ in range(repeat):
+        parse(texts)
+    elapsed = time.perf_counter() - started
+    return {
+        "prices_found": found,
+        "seconds": round(elapsed, 4),
+        "snippets_per_sec": round(len(texts) * repeat / elapsed),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--json', dest='json_path', help='куда записать результаты')
+    args = parser.parse_args()
+
+    texts = load_corpus()
+    results = {
+        "corpus_snippets": len(texts),
+        "repeat": args.repeat,
+        "legacy": run(legacy_parse, texts, args.repeat),
+        "single_pass": run(single_pass_parse, texts, args.repeat),
+    }
+    results["speedup"] = round(results["single_pass"]["snippets_per_sec"] / results["legacy"]["snippets_per_sec"], 2)
+
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""Бенчмарк колоночного pricing_engine против скалярных функций расчёта.
+
+Считает N случайных объектов скалярными calc_bti / calc_competitors /
+calc_recommended (main.py) и pricing_engine.price_portfolio, сверяет
+результаты до бита и печатает время. Если импортируется main_fixed.py,
+так же сверяются calculate_*_prices.
+
+    python benchmarks/bench_pricing_engine.py [--objects 5000] [--json results.json]
+
+Код выхода 1 при любом расхождении.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import main  # noqa: E402
+import pricing_engine  # noqa: E402
+
+REGIONS = ["77", "78", "50", "66", "23", "16"]
+
+
+def _portfolio(n: int, seed: int = 42):
+    rnd = random.Random(seed)
+    areas = [round(rnd.uniform(10, 5000), 2) for _ in range(n)]
+    regions = [rnd.choice(REGIONS) for _ in range(n)]
+    medians = [rnd.choice([120, 150, 165.5, 180, 200, 250]) for _ in range(n)]
+    return areas, regions, medians
+
+
+def _scalar_main(areas, regions, medians):
+    bti, comp, rec = [], [], []
+    for area, region, med in zip(areas, regions, medians):
+        b = main.calc_bti(area, region)
+        c = main.calc_competitors([med])
+        bti.append(b)
+        comp.append(c)
+        rec.append(main.calc_recommended(b['total'], c['final_price_per_m2'], area)['price'])
+    return bti, comp, rec
+
+
+def _check_main(areas, regions, medians, result, scalar) -> int:
+    bti, comp, rec = scalar
+    mismatches = 0
+    for i in range(len(areas)):
+        row = (
+            result['bti']['measurements'][i], result['bti']['techpassport'][i],
+            result['bti']['techassignment'][i], result['bti']['total'][i],
+            result['competitors']['price_per_m2'][i], result['competitors']['final_price_per_m2'][i],
+            result['recommended'][i],
+        )
+        expected = (
+            bti[i]['measurements'], bti[i]['techpassport'], bti[i]['techassignment'], bti[i]['total'],
+            comp[i]['price_per_m2'], comp[i]['final_price_per_m2'], rec[i],
+        )
+        if row != expected:
+            mismatches += 1
+    return mismatches
+
+
+def _check_main_fixed(areas, medians) -> dict:
+    try:
+        import main_fixed
+    except Exception as e:
+        return {"skipped": str(e)}
+    coef = main_fixed.CRPTI_COEFFICIENTS
+    started = time.perf_counter()
+    scalar = []
+    for area, med in zip(areas, medians):
+        b = main_fixed.calculate_bti_prices(area)
+        c = main_fixed.calculate_competitor_prices([med])
+        scalar.append((b, c, main_fixed.calculate_recommended_price(b['total'], c['price'])))
+    scalar_sec = time.perf_counter() - started
+
+    started = time.perf_counter()
+    bti = pricing_engine.price_bti_flat(areas, coef['coefficient_measurements'], coef['coefficient_tech'])
+    comp = pricing_engine.price_competitors_flat(medians)
+    rec = pricing_engine.price_recommended_flat(bti['total'], comp)
+    engine_sec = time.perf_counter() - started
+
+    mismatches = sum(
+        1 for i, (b, c, r) in enumerate(scalar)
+        if (b['measurements'], b['techpassport_task'], b['total'], c['price'], r['price'])
+        != (bti['measurements'][i], bti['techpassport_task'][i], bti['total'][i], comp[i], rec[i])
+    )
+    return {"scalar_sec": round(scalar_sec, 4), "engine_sec": round(engine_sec, 4), "mismatches": mismatches}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--objects', type=int, default=5000)
+    parser.add_argument('--json', dest='json_path')
+    args = parser.parse_args()
+
+    areas, regions, medians = _portfolio(args.objects)
+
+    started = time.perf_counter()
+    scalar = _scalar_main(areas, regions, medians)
+    scalar_sec = time.perf_counter() - started
+
+    started = time.perf_counter()
+    result = pricing_engine.price_portfolio(areas, regions, medians, main.TARIFF_TABLE)
+    engine_sec = time.perf_counter() - started
+
+    results = {
+        "objects": args.objects,
+        "main": {
+            "scalar_sec": round(scalar_sec, 4),
+            "engine_sec": round(engine_sec, 4),
+            "mismatches": _check_main(areas, regions, medians, result, scalar),
+        },
+        "main_fixed": _check_main_fixed(areas, medians),
+    }
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    failed = results["main"]["mismatches"] or results["main_fixed"].get("mismatches")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,126 @@
+"""Проверка точности и памяти QuantileSketch против statistics.median.
+
+Для выборок разного размера (реальные цены из корпуса сниппетов, повторённые
+с шумом, и логнормальные) сравнивает медиану скетча с точной:
+  * до compression наблюдений — совпадение до 1e-9;
+  * дальше — ошибка по рангу не больше --max-rank-error.
+Так же проверяются скетч, собранный merge из частей, и прошедший
+сериализацию to_dict → JSON → from_dict.
+
+    python benchmarks/bench_quantile_sketch.py [--trials 20] [--max-rank-error 0.02] [--json results.json]
+
+Код выхода 1, если граница нарушена.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+from bisect import bisect_left, bisect_right
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from price_parser import extract_prices  # noqa: E402
+from quantile_sketch import QuantileSketch, DEFAULT_COMPRESSION  # noqa: E402
+
+CORPUS_PATH = os.path.join(ROOT, 'benchmarks', 'data', 'serp_snippets.jsonl')
+SIZES = (5, 20, 100, 101, 500, 1000, 10000, 100000)
+
+
+def corpus_prices() -> list:
+    prices = []
+    if os.path.exists(CORPUS_PATH):
+        with open(CORPUS_PATH, encoding='utf-8') as f:
+            for line in f:
+                item = json.loads(line)
+                prices.extend(extract_prices(item.get('snippet', '').lower(), 20, 500))
+    return prices or [120, 150, 180, 200, 250]
+
+
+def _rank_error(sorted_values: list, estimate: float) -> float:
+    """Насколько ранг оценки отстоит от 0.5 (середина диапазона равных значений)."""
+    n = len(sorted_values)
+    rank = (bisect_left(sorted_values, estimate) + bisect_right(sorted_values, estimate)) / 2 / n
+    return abs(rank - 0.5)
+
+
+def check(name: str, values: list, max_rank_error: float) -> dict:
+    exact = statistics.median(values)
+    sorted_values = sorted(values)
+    started = time.perf_counter()
+    sketch = QuantileSketch.from_values(values)
+    estimate = sketch.median()
+    feed_sec = time.perf_counter() - started
+
+    third = len(values) // 3
+    merged = QuantileSketch.from_values(values[:third])
+    merged.merge(QuantileSketch.from_values(values[third:]))
+    restored = QuantileSketch.from_dict(json.loads(json.dumps(merged.to_dict())))
+
+    if len(values) <= DEFAULT_COMPRESSION:
+        # Точный режим: ранговая ошибка на малых n бессмысленна, сравниваем значения
+        errors = [0.0]
+        ok = all(abs(s.median() - exact) <= 1e-9 for s in (sketch, merged, restored))
+    else:
+        errors = [_rank_error(sorted_values, s.median()) for s in (sketch, merged, restored)]
+        ok = max(errors) <= max_rank_error
+    return {
+        "distribution": name,
+        "n": len(values),
+        "exact_median": round(exact, 3),
+        "sketch_median": round(estimate, 3),
+        "max_rank_error": round(max(errors), 5),
+        "relative_error": round(abs(estimate - exact) / exact, 5) if exact else 0.0,
+        "centroids": sketch.centroids,
+        "serialized_bytes": len(json.dumps(restored.to_dict())),
+        "feed_ns_per_value": round(feed_sec / len(values) * 1e9),
+        "ok": ok,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--trials', type=int, default=20)
+    parser.add_argument('--max-rank-error', type=float, default=0.02)
+    parser.add_argument('--json', dest='json_path', help='куда записать результаты')
+    args = parser.parse_args()
+
+    rnd = random.Random(42)
+    base = corpus_prices()
+    rows = []
+    for n in SIZES:
+        for _ in range(args.trials):
+            corpus = [round(rnd.choice(base) * rnd.uniform(0.9, 1.1)) for _ in range(n)]
+            rows.append(check("corpus", corpus, args.max_rank_error))
+            rows.append(check("lognormal", [rnd.lognormvariate(5, 0.5) for _ in range(n)], args.max_rank_error))
+
+    summary = {}
+    for row in rows:
+        key = f"{row['distribution']}/{row['n']}"
+        agg = summary.setdefault(key, {"trials": 0, "max_rank_error": 0.0, "max_relative_error": 0.0,
+                                       "max_centroids": 0, "feed_ns_per_value": row["feed_ns_per_value"],
+                                       "failures": 0})
+        agg["trials"] += 1
+        agg["max_rank_error"] = max(agg["max_rank_error"], row["max_rank_error"])
+        agg["max_relative_error"] = max(agg["max_relative_error"], row["relative_error"])
+        agg["max_centroids"] = max(agg["max_centroids"], row["centroids"])
+        agg["failures"] += 0 if row["ok"] else 1
+
+    results = {
+        "compression": DEFAULT_COMPRESSION,
+        "max_rank_error_bound": args.max_rank_error,
+        "cases": summary,
+        "failures": sum(agg["failures"] for agg in summary.values()),
+    }
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    sys.exit(1 if results["failures"] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+"""Локальные заглушки внешних API для бенчмарков: Росреестр, SERP, OpenAI, Telegram.
+
+Каждая заглушка — ThreadingHTTPServer на 127.0.0.1 со своим профилем задержки
+и доли ошибок. Ответы имитируют форму настоящих API ровно настолько, насколько
+её читают main.py и main_fixed.py.
+"""
+import os
+import json
+import time
+import random
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# Профили: (задержка, доля ошибок[, квота запросов/с]) по каждому апстриму;
+# задержка ±50% равномерно, сверх квоты — 429 с Retry-After
+PROFILES = {
+    "fast": {"reestr": (0.01, 0.0), "serp": (0.01, 0.0), "openai": (0.02, 0.0), "telegram": (0.005, 0.0)},
+    "realistic": {"reestr": (0.6, 0.02), "serp": (1.2, 0.05), "openai": (2.5, 0.01), "telegram": (0.08, 0.0)},
+    "degraded": {"reestr": (3.0, 0.3), "serp": (4.0, 0.2), "openai": (6.0, 0.1), "telegram": (0.3, 0.01)},
+    "quota": {"reestr": (0.3, 0.0, 5), "serp": (0.5, 0.0, 10), "openai": (1.0, 0.0), "telegram": (0.05, 0.0)},
+}
+
+ADDRESSES = [f"Москва, ул. Бенчмарковая, д. {i}" for i in range(1, 101)]
+
+
+def _load_snippets() -> list:
+    path = os.path.join(DATA_DIR, 'serp_snippets.jsonl')
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class StubServer:
+    """Один апстрим: сервер в фоновом потоке + журнал обслуженных запросов."""
+
+    def __init__(self, name: str, handler, latency: float, error_rate: float, quota_per_sec: float = 0,
+                 seed: int = 1):
+        self.name = name
+        self.latency = latency
+        self.error_rate = error_rate
+        self.quota_per_sec = quota_per_sec
+        self._window = []  # время приёма запросов за последнюю секунду
+        self.requests = []  # (path, status, served_sec)
+        self._rnd = random.Random(seed)
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _serve(self, method: str):
+                started = time.monotonic()
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                with stub._lock:
+                    delay = stub.latency * stub._rnd.uniform(0.5, 1.5)
+                    fail = stub._rnd.random() < stub.error_rate
+                    stub._window = [t for t in stub._window if started - t < 1.0]
+                    over_quota = bool(stub.quota_per_sec) and len(stub._window) >= stub.quota_per_sec
+                    if not over_quota:
+                        stub._window.append(started)
+                if over_quota:
+                    self._reply(429, b'{"error": "quota exceeded"}', 'application/json', {'Retry-After': '1'})
+                    with stub._lock:
+                        stub.requests.append((urlsplit(self.path).path, 429, time.monotonic() - started))
+                    return
+                time.sleep(delay)
+                if fail:
+                    status, payload, content_type = 500, b'{"error": "stub failure"}', 'application/json'
+                else:
+                    status, payload, content_type = handler(method, self.path, body, self.headers)
+                self._reply(status, payload, content_type)
+                with stub._lock:
+                    stub.requests.append((urlsplit(self.path).path, status, time.monotonic() - started))
+
+            def _reply(self, status: int, payload: bytes, content_type: str, headers: dict = None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(payload)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                self._serve('GET')
+
+            def do_POST(self):
+                self._serve('POST')
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name=f"stub-{name}", daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def start(self) -> "StubServer":
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+
+    def summary(self) -> dict:
+        with self._lock:
+            calls = list(self.requests)
+        by_path = {}
+        for path, status, _ in calls:
+            key = path.rsplit('/', 1)[-1]
+            by_path[key] = by_path.get(key, 0) + 1
+        return {
+            "calls": len(calls),
+            "errors": sum(1 for _, status, _ in calls if status >= 400),
+            "throttled_429": sum(1 for _, status, _ in calls if status == 429),
+            "by_endpoint": by_path,
+        }
+
+
+def _json(payload, status: int = 200):
+    return status, json.dumps(payload, ensure_ascii=False).encode('utf-8'), 'application/json'
+
+
+def reestr_handler(method, path, body, headers):
+    form = parse_qs(body.decode('utf-8'))
+    cad_num = (form.get('cad_num') or form.get('address') or ['77:01:0000001:1'])[0]
+    seed = sum(ord(c) for c in cad_num)
+    return _json({"list": [{
+        "cad_num": cad_num,
+        "address": ADDRESSES[seed % len(ADDRESSES)],
+        "area": f"{50 + seed % 400},{seed % 10}",
+        "unit": "кв.м",
+        "construction_end": str(1960 + seed % 60),
+        "oks_purpose": "Нежилое помещение" if seed % 3 else "Жилое помещение",
+        "walls_material": "Кирпичные",
+    }]})
+
+
+def make_serp_handler():
+    snippets = _load_snippets()
+
+    def serp_handler(method, path, body, headers):
+        query = parse_qs(urlsplit(path).query).get('query', [''])[0]
+        start = sum(ord(c) for c in query) % len(snippets)
+        results = [snippets[(start + i) % len(snippets)] for i in range(10)]
+        return _json({"json": {"res": results}})
+
+    return serp_handler
+
+
+PROPOSAL_TEXT = ("Предлагаем полный комплекс услуг БТИ: обмеры, технический паспорт и техническое задание. "
+                 "Рекомендованная стоимость учитывает официальные тарифы и рынок. Свяжитесь с нами.")
+
+
+def openai_handler(method, path, body, headers):
+    request = json.loads(body or b'{}')
+    now = int(time.time())
+    model = request.get('model', 'stub')
+    if not request.get('stream'):
+        return _json({
+            "id": "chatcmpl-stub", "object": "chat.completion", "created": now, "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": PROPOSAL_TEXT}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 300, "completion_tokens": 120, "total_tokens": 420},
+        })
+    events = []
+    for word in PROPOSAL_TEXT.split(' '):
+        chunk = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": now, "model": model,
+                 "choices": [{"index": 0, "delta": {"content": word + ' '}, "finish_reason": None}]}
+        events.append(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n")
+    events.append("data: [DONE]\n\n")
+    return 200, ''.join(events).encode('utf-8'), 'text/event-stream'
+
+
+def make_telegram_handler():
+    counter = {"message_id": 1000}
+    lock = threading.Lock()
+
+    def telegram_handler(method, path, body, headers):
+        api_method = urlsplit(path).path.rsplit('/', 1)[-1]
+        if api_method == 'getMe':
+            return _json({"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}})
+        if api_method in ('answerCallbackQuery', 'setWebhook', 'deleteWebhook'):
+            return _json({"ok": True, "result": True})
+        content_type = headers.get('Content-Type', '')
+        params = json.loads(body or b'{}') if 'json' in content_type else {
+            k: v[0] for k, v in parse_qs(body.decode('utf-8')).items()}
+        with lock:
+            counter["message_id"] += 1
+            message_id = counter["message_id"]
+        chat_id = int(params.get('chat_id') or 1)
+        return _json({"ok": True, "result": {
+            "message_id": int(params.get('message_id') or message_id),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": params.get('text', ''),
+        }})
+
+    return telegram_handler
+
+
+def start_stubs(profile: dict) -> dict:
+    """Запускает четыре заглушки с профилем {upstream: (latency, error_rate[, quota_per_sec])}."""
+    handlers = {
+        "reestr": reestr_handler,
+        "serp": make_serp_handler(),
+        "openai": openai_handler,
+        "telegram": make_telegram_handler(),
+    }
+    return {name: StubServer(name, handler, *profile[name]).start() for name, handler in handlers.items()}
+
+
+def stub_env(stubs: dict) -> dict:
+    """Переменные окружения, направляющие бота на заглушки."""
+    return {
+        "BOT_TOKEN": "123456:BENCH",
+        "OPENAI_API_KEY": "sk-bench",
+        "REESTR_API_TOKEN": "bench",
+        "SERPRIVER_API_KEY": "bench",
+        "REESTR_API_BASE": stubs["reestr"].url,
+        "SERP_API_URL": f"{stubs['serp'].url}/api/search.php",
+        "OPENAI_BASE_URL": f"{stubs['openai'].url}/v1",
+        "TELEGRAM_API_BASE": stubs["telegram"].url,
+    }
@@ -0,0 +1,229 @@
+import os
+import json
+import hashlib
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Кэш Росреестра: путь можно направить на volume Cloud Run, чтобы кэш переживал рестарты
+REESTR_CACHE_PATH = os.getenv('REESTR_CACHE_PATH', '/tmp/bti-cache/reestr.sqlite3')
+REESTR_CACHE_TTL_SEC = float(os.getenv('REESTR_CACHE_TTL_SEC', str(7 * 24 * 3600)))
+REESTR_CACHE_STALE_SEC = float(os.getenv('REESTR_CACHE_STALE_SEC', str(30 * 24 * 3600)))
+
+# Кэш распарсенных ответов SERP в памяти процесса
+SERP_CACHE_TTL_SEC = float(os.getenv('SERP_CACHE_TTL_SEC', str(6 * 3600)))
+SERP_CACHE_MAX_ENTRIES = int(os.getenv('SERP_CACHE_MAX_ENTRIES', '2000'))
+SERP_CACHE_MAX_BYTES = int(os.getenv('SERP_CACHE_MAX_BYTES', str(4 * 1024 * 1024)))
+
+# Кэш готовых коммерческих предложений (GPT)
+PROPOSAL_CACHE_TTL_SEC = float(os.getenv('PROPOSAL_CACHE_TTL_SEC', str(24 * 3600)))
+PROPOSAL_CACHE_MAX_ENTRIES = int(os.getenv('PROPOSAL_CACHE_MAX_ENTRIES', '500'))
+PROPOSAL_CACHE_MAX_BYTES = int(os.getenv('PROPOSAL_CACHE_MAX_BYTES', str(4 * 1024 * 1024)))
+
+
+class SQLiteTTLCache:
+    """Дисковый кэш JSON-значений с TTL и stale-while-revalidate.
+
+    Запись свежая в течение ttl секунд. После этого ещё stale_ttl секунд она
+    отдаётся сразу, а обновление запускается в фоновом потоке.
+    """
+
+    def __init__(self, path: str, ttl: float, stale_ttl: float = 0.0, table: str = "cache"):
+        self.path = path
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.table = table
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)"
+        )
+
+    def get(self, key: str):
+        """Возвращает (value, age_sec) или None, если записи нет или она протухла совсем."""
+        with self._lock:
+            row = self._conn.execute(f"SELECT value, stored_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        age = time.time() - row[1]
+        if age > self.ttl + self.stale_ttl:
+            return None
+        return json.loads(row[0]), age
+
+    def set(self, key: str, value) -> None:
+        payload = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, stored_at) VALUES (?, ?, ?)",
+                (key, payload, time.time())
+            )
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def get_or_load(self, key: str, loader):
+        """Отдаёт значение из кэша, при промахе вызывает loader().
+
+        Пустые результаты (None, {}) не кэшируются — это ошибка или «не найдено».
+        """
+        try:
+            cached = self.get(key)
+        except Exception as e:
+            logger.warning(f"Cache read error for {key}: {e}")
+            cached = None
+        if cached is not None:
+            value, age = cached
+            if age > self.ttl:
+                self._refresh_in_background(key, loader)
+            return value
+        value = loader()
+        self._store(key, value)
+        return value
+
+    def _store(self, key: str, value) -> None:
+        if not value:
+            return
+        try:
+            self.set(key, value)
+        except Exception as e:
+            logger.warning(f"Cache write error for {key}: {e}")
+
+    def _refresh_in_background(self, key: str, loader) -> None:
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self._store(key, loader())
+            except Exception as e:
+                logger.warning(f"Cache refresh error for {key}: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, name="cache-refresh", daemon=True).start()
+
+
+class LRUTTLCache:
+    """Потокобезопасный LRU-кэш в памяти с TTL и лимитами по числу записей и байтам.
+
+    Размер записи оценивается по длине её JSON-представления.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (value, size, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, expires_at = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value) -> None:
+        size = len(key) + len(json.dumps(value, ensure_ascii=False).encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, size, time.monotonic() + self.ttl)
+            self._bytes += size
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / total, 3) if total else 0.0,
+            }
+
+
+def normalize_query(query: str) -> str:
+    """Ключ кэша SERP: нижний регистр и схлопнутые пробелы."""
+    return " ".join(query.lower().split())
+
+
+serp_cache = LRUTTLCache(SERP_CACHE_MAX_ENTRIES, SERP_CACHE_MAX_BYTES, SERP_CACHE_TTL_SEC)
+
+
+def _rounded(value, ndigits: int):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return value
+    return round(float(value), ndigits)
+
+
+def proposal_fingerprint(object_data: dict, pricing_cards: dict, profile, model: str) -> str:
+    """Стабильный ключ КП: округлённые поля объекта и цен + профиль бюро и модель.
+
+    Суммы округляются до рубля, площадь — до 0.1 м², чтобы копеечные расхождения
+    в расчёте не давали промахов кэша.
+    """
+    obj = {k: _rounded(v, 1) if k == 'area' else v for k, v in object_data.items()}
+    if isinstance(obj.get('address'), str):
+        obj['address'] = " ".join(obj['address'].split())
+    prices = {k: _rounded(v, 1) if k == 'area' else _rounded(v, 0) for k, v in pricing_cards.items()}
+    payload = json.dumps([obj, prices, profile, model], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+proposal_cache = LRUTTLCache(PROPOSAL_CACHE_MAX_ENTRIES, PROPOSAL_CACHE_MAX_BYTES, PROPOSAL_CACHE_TTL_SEC)
+
+
+_reestr_cache = None
+_reestr_cache_lock = threading.Lock()
+
+
+def get_reestr_cache():
+    """Ленивая инициализация общего кэша Росреестра; None, если диск недоступен."""
+    global _reestr_cache
+    if _reestr_cache is None:
+        with _reestr_cache_lock:
+            if _reestr_cache is None:
+                try:
+                    _reestr_cache = SQLiteTTLCache(REESTR_CACHE_PATH, REESTR_CACHE_TTL_SEC,
+                                                   REESTR_CACHE_STALE_SEC, table="reestr")
+                except Exception as e:
+                    logger.warning(f"Reestr cache disabled: {e}")
+                    return None
+    return _reestr_cache
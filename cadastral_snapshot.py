@@ -0,0 +1,261 @@
+"""Локальный снимок кадастровых объектов: memory-mapped файл с бинарным поиском.
+
+Для регионов с большим потоком (77, 78, 50) атрибуты объектов берутся из
+заранее выгруженного снимка, а не из reestr-api.ru. Кадастровый номер
+упаковывается в 64-битный ключ, атрибуты лежат в колонках фиксированной
+ширины, файл отображается в память (mmap) и ищется бинарным поиском: чтение —
+микросекунды, в памяти процесса — только затронутые страницы.
+
+Формат (little-endian, секции выровнены на 8 байт):
+    заголовок    MAGIC, версия, N, длина JSON-словарей, длина строк адресов
+    keys         N × uint64, по возрастанию
+    area         N × float32 (NaN — нет данных)
+    build_year   N × uint16 (0 — нет данных)
+    room_type    N × uint16 — код в словаре room_types
+    materials    N × uint16 — код в словаре materials
+    addr_offsets (N + 1) × uint32 — границы адреса в блоке строк
+    словари      JSON {"room_types": [...], "materials": [...]}
+    адреса       UTF-8
+
+    python cadastral_snapshot.py build records.jsonl [-o snapshot.bin] [--regions 77 78 50]
+    python cadastral_snapshot.py lookup 77:09:0001013:1087 [--path snapshot.bin]
+
+Записи — JSONL или CSV с полями ответа fetch_reestr_data: cadastral_number,
+address, area, build_year, materials, room_type. Новый файл подменяется
+атомарно; работающие процессы подхватывают его после перезапуска.
+"""
+from __future__ import annotations
+
+import os
+import sys
+import csv
+import json
+import math
+import mmap
+import struct
+import logging
+import threading
+from array import array
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+CADASTRAL_SNAPSHOT_PATH = os.getenv('CADASTRAL_SNAPSHOT_PATH', '/tmp/bti-cache/cadastral.snapshot')
+# Регионы, которые импортёр кладёт в снимок по умолчанию
+CADASTRAL_SNAPSHOT_REGIONS = os.getenv('CADASTRAL_SNAPSHOT_REGIONS', '77,78,50').split(',')
+
+MAGIC = b'BTICAD01'
+_HEADER = struct.Struct('<8sIIQQ')  # magic, версия, N, длина словарей, длина адресов
+_VERSION = 1
+
+# Ширина частей ключа в битах: регион, район, квартал, номер объекта
+_REGION_BITS, _DISTRICT_BITS, _QUARTER_BITS, _OBJECT_BITS = 10, 10, 24, 20
+
+
+def pack_cadastral(cadastral_number: str) -> int | None:
+    """64-битный ключ кадастрового номера; None, если части не помещаются в ключ."""
+    parts = (cadastral_number or '').strip().split(':')
+    if len(parts) != 4 or not all(p.isdigit() for p in parts):
+        return None
+    key = 0
+    for value, bits in zip(map(int, parts), (_REGION_BITS, _DISTRICT_BITS, _QUARTER_BITS, _OBJECT_BITS)):
+        if value >= 1 << bits:
+            return None
+        key = (key << bits) | value
+    return key
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def _layout(n: int) -> dict:
+    """Смещения секций относительно начала файла."""
+    offsets = {}
+    position = _HEADER.size
+    for name, item_size, count in (('keys', 8, n), ('area', 4, n), ('build_year', 2, n),
+                                   ('room_type', 2, n), ('materials', 2, n), ('addr_offsets', 4, n + 1)):
+        position = _align(position)
+        offsets[name] = (position, item_size * count)
+        position += item_size * count
+    offsets['dictionaries'] = _align(position)
+    return offsets
+
+
+def _read_records(path: str):
+    with open(path, encoding='utf-8', newline='') as f:
+        if path.endswith('.csv'):
+            yield from csv.DictReader(f)
+            return
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def build_snapshot(records, output: str, regions=CADASTRAL_SNAPSHOT_REGIONS) -> int:
+    """Собирает снимок из записей; возвращает число объектов. Файл подменяется атомарно."""
+    regions = {r.strip().zfill(2) for r in regions if r.strip()} if regions else None
+    rows = {}
+    for record in records:
+        cadastral_number = str(record.get('cadastral_number') or '').strip()
+        key = pack_cadastral(cadastral_number)
+        if key is None or (regions and cadastral_number.split(':')[0].zfill(2) not in regions):
+            continue
+        rows[key] = record  # при повторе номера побеждает последняя запись
+    keys = sorted(rows)
+
+    room_types, materials = [''], ['']  # код 0 — нет данных
+    room_codes, material_codes = {'': 0}, {'': 0}
+
+    def code(value, values: list, codes: dict) -> int:
+        value = str(value or '').strip()
+        if value not in codes:
+            codes[value] = len(values)
+            values.append(value)
+        return codes[value]
+
+    area, build_year, room_type, material = array('f'), array('H'), array('H'), array('H')
+    addr_offsets, addresses = array('I', [0]), bytearray()
+    for key in keys:
+        record = rows[key]
+        try:
+            area.append(float(str(record.get('area')).replace(',', '.')))
+        except (TypeError, ValueError):
+            area.append(math.nan)
+        try:
+            build_year.append(int(record.get('build_year') or 0))
+        except (TypeError, ValueError):
+            build_year.append(0)
+        room_type.append(code(record.get('room_type'), room_types, room_codes))
+        material.append(code(record.get('materials'), materials, material_codes))
+        addresses += str(record.get('address') or '').encode('utf-8')
+        addr_offsets.append(len(addresses))
+
+    dictionaries = json.dumps({"room_types": room_types, "materials": materials}, ensure_ascii=False).encode('utf-8')
+    layout = _layout(len(keys))
+    columns = {'keys': array('Q', keys), 'area': area, 'build_year': build_year,
+               'room_type': room_type, 'materials': material, 'addr_offsets': addr_offsets}
+    tmp = f"{output}.{os.getpid()}.tmp"
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(tmp, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, _VERSION, len(keys), len(dictionaries), len(addresses)))
+        for name, column in columns.items():
+            if sys.byteorder != 'little':
+                column.byteswap()
+            f.seek(layout[name][0])
+            column.tofile(f)
+        f.seek(layout['dictionaries'])
+        f.write(dictionaries)
+        f.write(addresses)
+    os.replace(tmp, output)
+    return len(keys)
+
+
+class CadastralSnapshot:
+    """Чтение снимка через mmap: колонки — memoryview без копирования."""
+
+    def __init__(self, path: str = CADASTRAL_SNAPSHOT_PATH):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n, dict_len, addr_len = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != _VERSION:
+            raise ValueError(f"{path}: not a cadastral snapshot v{_VERSION}")
+        if sys.byteorder != 'little':
+            raise ValueError("cadastral snapshot requires a little-endian host")
+        self.size = n
+        view = memoryview(self._mmap)
+        layout = _layout(n)
+        formats = {'keys': 'Q', 'area': 'f', 'build_year': 'H', 'room_type': 'H',
+                   'materials': 'H', 'addr_offsets': 'I'}
+        for name, fmt in formats.items():
+            start, length = layout[name]
+            setattr(self, f"_{name}", view[start:start + length].cast(fmt))
+        start = layout['dictionaries']
+        dictionaries = json.loads(bytes(view[start:start + dict_len]).decode('utf-8'))
+        self._room_types = dictionaries['room_types']
+        self._materials_dict = dictionaries['materials']
+        self._addresses = view[start + dict_len:start + dict_len + addr_len]
+
+    def get(self, cadastral_number: str) -> dict | None:
+        """Атрибуты объекта в формате fetch_reestr_data; None — номера нет в снимке."""
+        key = pack_cadastral(cadastral_number)
+        i = bisect_left(self._keys, key) if key is not None else self.size
+        found = i < self.size and self._keys[i] == key
+        with self._lock:
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if not found:
+            return None
+        area = self._area[i]
+        address = bytes(self._addresses[self._addr_offsets[i]:self._addr_offsets[i + 1]]).decode('utf-8')
+        return {
+            "address": address or None,
+            "cadastral_number": cadastral_number,
+            "area": None if math.isnan(area) else round(area, 2),
+            "build_year": self._build_year[i] or None,
+            "materials": self._materials_dict[self._materials[i]] or None,
+            "room_type": self._room_types[self._room_type[i]] or None,
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"objects": self.size, "file_bytes": len(self._mmap), "hits": self.hits, "misses": self.misses}
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+_snapshot_checked = False
+
+
+def get_cadastral_snapshot():
+    """Ленивое открытие снимка; None, если файла нет или он повреждён."""
+    global _snapshot, _snapshot_checked
+    if not _snapshot_checked:
+        with _snapshot_lock:
+            if not _snapshot_checked:
+                if os.path.exists(CADASTRAL_SNAPSHOT_PATH):
+                    try:
+                        _snapshot = CadastralSnapshot(CADASTRAL_SNAPSHOT_PATH)
+                        logger.info(f"Cadastral snapshot mapped: {_snapshot.size} objects")
+                    except Exception as e:
+                        logger.warning(f"Cadastral snapshot disabled: {e}")
+                _snapshot_checked = True
+    return _snapshot
+
+
+def snapshot_lookup(cadastral_number: str) -> dict | None:
+    snapshot = get_cadastral_snapshot()
+    return snapshot.get(cadastral_number) if snapshot is not None else None
+
+
+def snapshot_stats() -> dict | None:
+    snapshot = get_cadastral_snapshot()
+    return snapshot.stats() if snapshot is not None else None
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Локальный снимок кадастровых объектов")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='собрать снимок из JSONL/CSV')
+    build.add_argument('input')
+    build.add_argument('-o', '--output', default=CADASTRAL_SNAPSHOT_PATH)
+    build.add_argument('--regions', nargs='*', default=CADASTRAL_SNAPSHOT_REGIONS,
+                       help='коды регионов; пусто — все')
+    lookup = commands.add_parser('lookup', help='найти объект в снимке')
+    lookup.add_argument('cadastral_number')
+    lookup.add_argument('--path', default=CADASTRAL_SNAPSHOT_PATH)
+    args = parser.parse_args()
+    if args.command == 'build':
+        count = build_snapshot(_read_records(args.input), args.output, args.regions)
+        print(f"{args.output}: {count} objects, {os.path.getsize(args.output)} bytes")
+    else:
+        print(json.dumps(CadastralSnapshot(args.path).get(args.cadastral_number), ensure_ascii=False, indent=2))
@@ -0,0 +1,59 @@
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+logger = logging.getLogger(__name__)
+
+# Параметры параллельного опроса SERP (можно переопределить через env)
+SERP_MAX_CONCURRENCY = int(os.getenv('SERP_MAX_CONCURRENCY', '4'))
+SERP_DEADLINE_SEC = float(os.getenv('SERP_DEADLINE_SEC', '12'))
+
+
+def fan_out(func, items: list, max_concurrency: int = SERP_MAX_CONCURRENCY,
+            deadline: float = SERP_DEADLINE_SEC) -> list:
+    """Выполняет func(item, timeout) параллельно с общим бюджетом времени.
+
+    Возвращает список результатов в порядке завершения. Вызовы, не успевшие
+    до дедлайна, отбрасываются — вызывающий получает то, что уже готово.
+    При max_concurrency <= 1 вызовы идут последовательно, как раньше.
+    """
+    results = []
+    started = time.monotonic()
+
+    def remaining() -> float:
+        return deadline - (time.monotonic() - started)
+
+    if max_concurrency <= 1:
+        for item in items:
+            left = remaining()
+            if left <= 0:
+                logger.warning(f"Fan-out deadline {deadline}s reached, skipped {len(items) - len(results)} calls")
+                break
+            try:
+                results.append(func(item, left))
+            except Exception as e:
+                logger.warning(f"Fan-out call failed for {item!r}: {e}")
+        return results
+
+    executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="fan-out")
+    try:
+        # Таймаут отдельного запроса не может превышать общий бюджет
+        pending = {executor.submit(func, item, deadline): item for item in items}
+        while pending:
+            left = remaining()
+            if left <= 0:
+                break
+            done, _ = wait(pending, timeout=left, return_when=FIRST_COMPLETED)
+            for fut in done:
+                item = pending.pop(fut)
+                try:
+                    results.append(fut.result())
+                except Exception as e:
+                    logger.warning(f"Fan-out call failed for {item!r}: {e}")
+        if pending:
+            logger.warning(f"Fan-out deadline {deadline}s reached, dropped {len(pending)} of {len(items)} calls")
+    finally:
+        # Не ждём зависшие запросы: они завершатся по своему таймауту
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results
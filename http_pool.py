@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import os
+import logging
+import threading
+from typing import TYPE_CHECKING
+from ratelimit import limiters
+
+if TYPE_CHECKING:
+    import requests
+
+logger = logging.getLogger(__name__)
+
+# Общий пул keep-alive соединений на процесс (воркер gunicorn)
+HTTP_POOL_HOSTS = int(os.getenv('HTTP_POOL_HOSTS', '8'))
+HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', '16'))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '5'))
+# Адреса внешних API; переопределяются, например, для локальных заглушек в benchmarks/
+REESTR_API_BASE = os.getenv('REESTR_API_BASE', 'https://reestr-api.ru')
+SERP_API_URL = os.getenv('SERP_API_URL', 'https://serpriver.ru/api/search.php')
+OPENAI_API_BASE = os.getenv('OPENAI_BASE_URL', 'https://api.openai.com/v1')
+TELEGRAM_API_BASE = os.getenv('TELEGRAM_API_BASE', 'https://api.telegram.org')
+
+# Пул httpx внутри PTB (по умолчанию в PTB всего одно соединение к Bot API)
+TELEGRAM_POOL_SIZE = int(os.getenv('TELEGRAM_POOL_SIZE', '16'))
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Сессия requests с пулом соединений по хостам, создаётся один раз на процесс."""
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                # requests импортируется при первом запросе, а не при старте процесса
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_MAXSIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session, _session_pid = session, pid
+                logger.info(f"HTTP pool created: hosts={HTTP_POOL_HOSTS}, maxsize={HTTP_POOL_MAXSIZE}")
+    return _session
+
+
+def _send(method: str, url: str, timeout: float, upstream: str = None, budget: float = None,
+          **kwargs) -> requests.Response:
+    def send():
+        return get_session().request(method, url, timeout=(min(HTTP_CONNECT_TIMEOUT, timeout), timeout), **kwargs)
+    if upstream is None:
+        return send()
+    # Платный апстрим: темп по квоте, повторы с backoff (см. ratelimit.py)
+    return limiters[upstream].call(send, budget=budget)
+
+
+def http_get(url: str, timeout: float, **kwargs) -> requests.Response:
+    """GET через общий пул; timeout — таймаут чтения, коннект ограничен HTTP_CONNECT_TIMEOUT.
+    upstream='reestr'|'serp' включает лимит темпа и повторы, budget — их общий бюджет времени."""
+    return _send('GET', url, timeout, **kwargs)
+
+
+def http_post(url: str, timeout: float, **kwargs) -> requests.Response:
+    """POST через общий пул; параметры как у http_get."""
+    return _send('POST', url, timeout, **kwargs)
+
+
+def pool_stats() -> dict:
+    """Статистика по хостам: запросы, открытые соединения и переиспользования."""
+    if _session is None:
+        return {}
+    stats = {}
+    # Один адаптер смонтирован и на https://, и на http://
+    pools = _session.get_adapter('https://').poolmanager.pools
+    # RecentlyUsedContainer не поддерживает итерацию, только keys()
+    for key in pools.keys():
+        pool = pools.get(key)
+        if pool is None:
+            continue
+        host = f"{pool.host}:{pool.port}" if pool.port else pool.host
+        entry = stats.setdefault(host, {"requests": 0, "connections": 0, "reused": 0})
+        entry["requests"] += pool.num_requests
+        entry["connections"] += pool.num_connections
+        entry["reused"] = max(entry["requests"] - entry["connections"], 0)
+    return stats
@@ -3,7 +3,7 @@
 
 import os
 import json
-import requests
+from http_pool import http_post, pool_stats
 from flask import Flask, request
 
 app = Flask(__name__)
@@ -43,7 +43,7 @@ def handler():
 
 @app.route("/health", methods=["GET"])
 def health():
-    return {"status": "ok"}
+    return {"status": "ok", "http_pool": pool_stats()}
 
 def validate_cadastral(number: str) -> bool:
     """Проверка формата кадастрового номера"""
@@ -93,7 +93,7 @@ def send_message(chat_id: int, text: str):
         "parse_mode": "Markdown"
     }
     try:
-        requests.post(url, json=payload, timeout=5)
+        http_post(url, timeout=5, json=payload)
     except Exception as e:
         print(f"Ошибка отправки сообщения: {e}")
 
@@ -1,14 +1,38 @@
+from __future__ import annotations
+
 import os
 import json
+import time
 import logging
 import asyncio
 import threading
 import re
-import requests
-import statistics
-from flask import Flask, request, jsonify
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
+import csv
+import io
+from typing import TYPE_CHECKING
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from fanout import fan_out
+from offload import run_blocking
+from progressive import ThrottledEditor
+from http_pool import (http_get, http_post, pool_stats, TELEGRAM_POOL_SIZE, TELEGRAM_API_BASE,
+                       SERP_API_URL, OPENAI_API_BASE)
+from price_parser import extract_prices
+from pricing_engine import TariffTable, price_portfolio
+from caches import get_reestr_cache, serp_cache, normalize_query, proposal_cache, proposal_fingerprint
+from update_queue import UpdateQueue, WEBHOOK_ASYNC_ACK
+from session_store import Session, create_session_store
+from ratelimit import limiter_stats
+from reestr_client import request_reestr, reestr_stats
+from singleflight import reestr_flight, serp_query_flight, serp_search_flight, singleflight_stats
+from price_index import get_price_index, price_index_keys, price_index_stats
+from quantile_sketch import QuantileSketch, median_of
+from cadastral_snapshot import snapshot_lookup, snapshot_stats
+from metrics import timed, record_error, record_fallback, record_duration, observe, instrumented_telegram_request, render as render_metrics
+from flask import Flask, Response, request, jsonify
+# telegram импортируется при первом апдейте (init_bot/webhook), а не при старте процесса
+if TYPE_CHECKING:
+    from telegram import Update
+    from telegram.ext import ContextTypes
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -35,15 +59,24 @@ def load_secrets():
         'SERPRIVER_API_KEY': os.getenv('SERPRIVER_API_KEY', '')
     }
 
-# Загружаем секреты
-secrets = load_secrets()
+class _LazySecrets:
+    """Секреты читаются при первом обращении, а не при импорте модуля (холодный старт)"""
+    def __init__(self):
+        self._data = None
+    def get(self, key: str, default=None):
+        if self._data is None:
+            self._data = load_secrets()
+        return self._data.get(key, default)
+
+secrets = _LazySecrets()
 
 app = Flask(__name__)
 
-user_data = {}
+sessions = create_session_store()
 application = None
 _background_loop = None
 _loop_thread = None
+update_queue = None
 
 # --- Bureau profile (can be overridden via env JSON BUREAU_PROFILE) ---
 DEFAULT_BUREAU_PROFILE = {
@@ -77,6 +110,19 @@ BTI_TARIFFS_BY_REGION = {
     "50": (40.0, 200.0, 200.0),        # Moscow region
 }
 DEFAULT_TARIFFS = (45.0, 220.0, 220.0)
+# Та же таблица в колоночном виде: по ней /batch считает портфель (pricing_engine.price_portfolio)
+TARIFF_TABLE = TariffTable(BTI_TARIFFS_BY_REGION, DEFAULT_TARIFFS)
+
+# Префикс ключей общих кэшей (serp_cache, proposal_cache): в main_fixed.py
+# другие параметры SERP, диапазон цен и промпт КП
+CACHE_NAMESPACE = "main"
+
+# Пакетный расчёт портфеля (/batch)
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '4'))
+BATCH_MAX_OBJECTS = int(os.getenv('BATCH_MAX_OBJECTS', '1000'))
+
+# Одно статус-сообщение, которое правится по мере готовности карточек (0 — отдельные сообщения)
+PROGRESSIVE_QUOTE_MESSAGE = os.getenv('PROGRESSIVE_QUOTE_MESSAGE', '1') == '1'
 
 CRPTI_COEFFICIENTS = {
     'coefficient_measurements': 50,
@@ -113,6 +159,8 @@ def get_bti_tariffs_for_region(region_code: str) -> tuple[float, float, float]:
     return BTI_TARIFFS_BY_REGION.get(region_code, DEFAULT_TARIFFS)
 
 # --- GPT commercial proposal ---
+PROPOSAL_MODEL = "gpt-4o-mini"
+
 def _load_bureau_profile() -> dict:
     raw = os.getenv("BUREAU_PROFILE")
     if not raw:
@@ -152,9 +200,18 @@ def generate_commercial_proposal(address: str, area: float, room_type: str, mate
     api_key = secrets.get("OPENAI_API_KEY")
     if not api_key:
         logger.warning("OPENAI_API_KEY missing; using fallback template")
+        record_fallback('gpt_call')
         return _compose_structured_fallback_proposal(address, area, room_type, materials, build_year, region_code, bti_total, market_total, recommended_total, bti_tariffs)
+    bureau = _load_bureau_profile()
+    # Общий proposal_cache: ключ с префиксом бота, у main_fixed.py свои промпт и модель
+    cache_key = CACHE_NAMESPACE + ":" + proposal_fingerprint(
+        {"address": address, "area": area, "room_type": room_type, "materials": materials, "build_year": build_year, "region": region_code},
+        {"bti_total": bti_total, "market_total": market_total, "recommended_total": recommended_total, **bti_tariffs},
+        bureau, PROPOSAL_MODEL)
+    cached = proposal_cache.get(cache_key)
+    if cached is not None:
+        return cached
     try:
-        bureau = _load_bureau_profile()
         headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json",
@@ -171,7 +228,7 @@ def generate_commercial_proposal(address: str, area: float, room_type: str, mate
             f"Бюро: название={bureau['name']}; опыт={bureau['years']} лет; проектов={bureau['projects_total']}; кейсы={'; '.join(bureau['notable_cases'])}; преимущества={'; '.join(bureau['advantages'])}; контакты={bureau['contacts']['email']} / {bureau['contacts']['phone']}."
         )
         body = {
-            "model": "gpt-4o-mini",
+            "model": PROPOSAL_MODEL,
             "messages": [
                 {"role": "system", "content": "Ты опытный пресейл-архитектор. Пиши кратко, структурно и убедительно."},
                 {"role": "user", "content": prompt}
@@ -179,17 +236,25 @@ def generate_commercial_proposal(address: str, area: float, room_type: str, mate
             "temperature": 0.6,
             "max_tokens": 500,
         }
-        resp = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, data=json.dumps(body), timeout=25)
+        # В gpt_call — только сам запрос к OpenAI, без попаданий в кэш КП
+        started = time.perf_counter()
+        try:
+            resp = http_post(f"{OPENAI_API_BASE}/chat/completions", timeout=25, headers=headers, data=json.dumps(body))
+        finally:
+            record_duration('gpt_call', time.perf_counter() - started)
         if resp.status_code != 200:
             logger.warning(f"OpenAI API error: {resp.status_code} {resp.text}")
+            record_error('gpt_call'); record_fallback('gpt_call')
             return _compose_structured_fallback_proposal(address, area, room_type, materials, build_year, region_code, bti_total, market_total, recommended_total, bti_tariffs)
         data = resp.json()
         text = data.get("choices", [{}])[0].get("message", {}).get("content")
         if not text:
             raise ValueError("empty completion")
+        proposal_cache.set(cache_key, text.strip())
         return text.strip()
     except Exception as e:
         logger.error(f"Proposal generation error: {e}")
+        record_error('gpt_call'); record_fallback('gpt_call')
         return _compose_structured_fallback_proposal(address, area, room_type, materials, build_year, region_code, bti_total, market_total, recommended_total, bti_tariffs)
 
 def generate_fallback_data(cadastral_number: str) -> dict:
@@ -222,49 +287,65 @@ def generate_fallback_data(cadastral_number: str) -> dict:
     }
 
 # Helper: add after recommendation
-async def send_commercial_proposal(update: Update, address: str, area: float, room_type: str, materials: str, build_year, region_code: str, bti_total: float, market_total: float, recommended_total: float, bti_tariffs: dict):
-    await update.message.reply_text("🧾 Формирую коммерческое предложение…")
-    text = generate_commercial_proposal(address, area, room_type, materials, build_year, region_code, bti_total, market_total, recommended_total, bti_tariffs)
-    await update.message.reply_text(text)
+async def send_commercial_proposal(update: Update, address: str, area: float, room_type: str, materials: str, build_year, region_code: str, bti_total: float, market_total: float, recommended_total: float, bti_tariffs: dict, announce=None):
+    # GPT стартует сразу, статус (announce() или отдельное сообщение) уходит параллельно с ним
+    proposal = asyncio.ensure_future(run_blocking(generate_commercial_proposal, address, area, room_type, materials, build_year, region_code, bti_total, market_total, recommended_total, bti_tariffs))
+    if announce is None:
+        await update.message.reply_text("🧾 Формирую коммерческое предложение…")
+    else:
+        await announce()
+    await update.message.reply_text(await proposal)
+
+@timed('reestr_lookup')
+def lookup_reestr_data(query: str, search_type: str = "cadastral") -> dict | None:
+    """Данные Росреестра через дисковый TTL-кэш; None — API недоступен.
+    Одновременные запросы одного номера ждут один общий запрос к API.
+    Кадастровый номер сначала ищется в локальном снимке (cadastral_snapshot)"""
+    if search_type == "cadastral":
+        data = snapshot_lookup(query)
+        if data is not None:
+            return data
+    key = f"{search_type}:{query}"
+    data = reestr_flight.do(key, lambda: _lookup_reestr_cached(key, query, search_type))
+    if data is None:
+        record_error('reestr_lookup')
+    return data
+
+def _lookup_reestr_cached(key: str, query: str, search_type: str) -> dict | None:
+    cache = get_reestr_cache()
+    if cache is None:
+        return _fetch_reestr_remote(query, search_type)
+    return cache.get_or_load(key, lambda: _fetch_reestr_remote(query, search_type))
 
 def fetch_reestr_data(query: str, search_type: str = "cadastral") -> dict:
+    """Данные Росреестра; при сбое API — fallback"""
+    data = lookup_reestr_data(query, search_type)
+    if data is None:
+        logger.info("🔄 Используем fallback данные")
+        record_fallback('reestr_lookup')
+        return generate_fallback_data(query)
+    return data
+
+# None означает сбой API (нужен fallback), {} — объект не найден
+def _fetch_reestr_remote(query: str, search_type: str = "cadastral") -> dict | None:
     try:
         token = secrets.get('REESTR_API_TOKEN')
         if not token:
             logger.error("REESTR_API_TOKEN missing")
-            # Fallback: generate basic data
-            return generate_fallback_data(query)
+            return None
         
         logger.info(f"🔍 Запрос к Росреестру для {query}")
         
-        if search_type == "cadastral":
-            url = f"https://reestr-api.ru/v1/search/cadastrFull?auth_token={token}"
-            data = {"cad_num": query}
-        else:
-            url = f"https://reestr-api.ru/v1/search/address?auth_token={token}"
-            data = {"address": query}
-        
-        r = requests.post(url, data=data, timeout=15)
-        logger.info(f"📡 Ответ Росреестра: {r.status_code}")
-        
-        if r.status_code == 404 and search_type == "cadastral":
-            url2 = f"https://reestr-api.ru/v1/search/cadastr?auth_token={token}"
-            r = requests.post(url2, data={"cad_num": query}, timeout=15)
-            logger.info(f"📡 Повторный запрос: {r.status_code}")
-            if r.status_code != 200:
-                logger.warning("❌ Росреестр недоступен, используем fallback")
-                return generate_fallback_data(query)
-        elif r.status_code != 200:
+        # cadastrFull и хеджирующий cadastr, при открытом breaker — сразу None
+        js = request_reestr(query, search_type, token)
+        if js is None:
             logger.warning("❌ Росреестр недоступен, используем fallback")
-            return generate_fallback_data(query)
-        
-        js = r.json()
+            return None
         logger.info(f"📊 JSON ответ: {js}")
         
     except Exception as e:
         logger.error(f"Reestr error: {e}")
-        logger.info("🔄 Используем fallback данные")
-        return generate_fallback_data(query)
+        return None
     try:
         items = js.get("list") or []
         if not items and isinstance(js, dict):
@@ -319,9 +400,44 @@ def fetch_reestr_data(query: str, search_type: str = "cadastral") -> dict:
         logger.error(f"Reestr parse error: {e}")
         return {}
 
-def search_competitor_prices(address: str, area: float) -> list:
+def _serp_query(q: str, timeout: float, index_keys: tuple = ()) -> list:
+    cache_key = f"{CACHE_NAMESPACE}:{normalize_query(q)}"
+    cached = serp_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    return serp_query_flight.do(cache_key, lambda: _serp_fetch(q, cache_key, timeout, index_keys), timeout=timeout)
+
+def _serp_fetch(q: str, cache_key: str, timeout: float, index_keys: tuple = ()) -> list:
+    # В serp_query — только запрос к апстриму, без попаданий в кэш и ожидающих single-flight
+    with observe('serp_query'):
+        res = http_get(SERP_API_URL, timeout=min(10, timeout), params={
+            "api_key": secrets.get('SERPRIVER_API_KEY'), "system":"google","domain":"ru","query": q,
+            "result_cnt": 10, "lr": 213
+        }, upstream="serp", budget=timeout)
+    if res.status_code != 200:
+        record_error('serp_query')
+        return []
+    data = res.json(); arr = data.get('json',{}).get('res',[])
+    prices = parse_competitor_prices(arr)
+    serp_cache.set(cache_key, prices)
+    # В индекс попадают только цены, реально полученные из SERP: ответы из
+    # serp_cache и результаты ожидающих single-flight уже учтены
+    index = get_price_index() if index_keys and prices else None
+    if index is not None:
+        try:
+            index.record(index_keys, QuantileSketch.from_values(prices))
+        except Exception as e:
+            logger.warning(f"Price index update failed: {e}")
+    return prices
+
+def search_competitor_prices(address: str, area: float, index_keys: tuple = ()) -> QuantileSketch:
+    # Свежая и достаточно полная запись регионального индекса заменяет SERP
+    index = get_price_index() if index_keys else None
+    if index is not None:
+        indexed = index.fresh_sketch(index_keys)
+        if indexed:
+            return indexed
     key = secrets.get('SERPRIVER_API_KEY')
-    prices = []
     queries = [
         f"БТИ услуги обмеры {address} цена за м²",
         f"техпаспорт БТИ {address} стоимость",
@@ -329,36 +445,36 @@ def search_competitor_prices(address: str, area: float) -> list:
         f"БТИ замеры {int(area)} м² цена"
     ]
     if not key:
-        return [120,150,180,200,250]
-    for q in queries:
-        try:
-            res = requests.get("https://serpriver.ru/api/search.php", params={
-                "api_key": key, "system":"google","domain":"ru","query": q,
-                "result_cnt": 10, "lr": 213
-            }, timeout=10)
-            if res.status_code == 200:
-                data = res.json(); arr = data.get('json',{}).get('res',[])
-                prices.extend(parse_competitor_prices(arr))
-        except Exception:
-            continue
-    return prices or [120,150,180,200,250]
+        record_fallback('serp_query')
+        return QuantileSketch.from_values([120,150,180,200,250])
+    # Тот же объект, уже считающийся в другом потоке, ждёт его fan-out
+    prices = serp_search_flight.do(f"{CACHE_NAMESPACE}:{normalize_query(address)}|{int(area)}", lambda: _collect_serp_prices(queries, index_keys))
+    if not prices.count:
+        record_fallback('serp_query')
+        return QuantileSketch.from_values([120,150,180,200,250])
+    return prices
 
+def _collect_serp_prices(queries: list, index_keys: tuple = ()) -> QuantileSketch:
+    prices = QuantileSketch()
+    # Запросы идут параллельно с общим дедлайном (SERP_MAX_CONCURRENCY, SERP_DEADLINE_SEC);
+    # цены вливаются в скетч по мере прихода ответов
+    for found in fan_out(lambda q, timeout: _serp_query(q, timeout, index_keys), queries):
+        prices.update(found)
+    # Скетч делят ожидающие single-flight: после compress() чтение его не меняет
+    prices.compress()
+    return prices
+
+@timed('price_parse')
 def parse_competitor_prices(results: list) -> list:
     prices = []
     for r in results:
-        sn = r.get('snippet','').lower()
-        for pat in [r'(\d+)\s*руб[./]?\s*м[²2]', r'(\d+)\s*руб[./]?\s*кв[./]?м', r'(\d+)\s*руб[./]?\s*за\s*м[²2]', r'от\s*(\d+)\s*руб']:
-            for m in re.findall(pat, sn):
-                try:
-                    v = int(m)
-                    if 20 <= v <= 500:
-                        prices.append(v)
-                except: pass
+        prices.extend(extract_prices(r.get('snippet','').lower(), 20, 500))
     return prices
 
 # Refactored: calculate BTI costs using regional tariffs
 # Returns dict with per-service and total, plus tariffs used
 
+@timed('pricing_calc')
 def calc_bti(area: float, region_code: str) -> dict:
     meas_tar, tp_tar, ta_tar = get_bti_tariffs_for_region(region_code)
     measurements = area * meas_tar
@@ -378,11 +494,14 @@ def calc_bti(area: float, region_code: str) -> dict:
         }
     }
 
-def calc_competitors(prices: list) -> dict:
-    med = statistics.median(prices) if prices else 150
+@timed('pricing_calc')
+def calc_competitors(prices) -> dict:
+    """prices — список цен или QuantileSketch"""
+    med = median_of(prices, 150)
     final_per_m2 = med * 1.22 * 1.10
     return {"price_per_m2": round(med,2), "final_price_per_m2": round(final_per_m2,2)}
 
+@timed('pricing_calc')
 def calc_recommended(bti_total: float, comp_final_per_m2: float, area: float) -> dict:
     comp_total = comp_final_per_m2 * area
     rec = (bti_total + comp_total) / 2
@@ -390,11 +509,10 @@ def calc_recommended(bti_total: float, comp_final_per_m2: float, area: float) ->
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    user_data[user_id] = {'step': 'waiting_cadastral'}
+    sessions.save(user_id, Session())
     await update.message.reply_text("🏠 Привет! Введите кадастровый номер (пример: 77:09:0001013:1087)")
 
 async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    import time as _time
     user_id = update.effective_user.id
     text = update.message.text
     logger.info(f"📨 Получено сообщение от {user_id}: {text}")
@@ -404,14 +522,42 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❓ Введите кадастровый номер формата a:b:c:d")
         return
     
+    # Сетевые вызовы Telegram не ждут друг друга и апстримы: каждый этап стартует
+    # до отправки статуса о нём. В прогрессивном режиме все карточки — правки одного
+    # сообщения, КП — отдельное сообщение.
+    editor = None
+
+    async def show(cards: list, note: str = None, final: bool = False) -> None:
+        if editor is not None:
+            body = "\n\n".join(cards + [note] if note else cards)
+            if not final:
+                await editor.update(body)  # промежуточная правка: сбой не критичен
+                return
+            try:
+                await editor.flush(body)
+            except Exception as e:
+                logger.warning(f"Progressive edit failed ({e}), sending cards as a new message")
+                await update.message.reply_text(body)
+            return
+        await update.message.reply_text(cards[-1])
+        if note:
+            await update.message.reply_text(note)
+
     # Scene 1: Rosreestr lookup
-    t0 = _time.time()
-    await update.message.reply_text("🔎 Поиск в Росреестре…")
-    data = fetch_reestr_data(text, "cadastral")
-    t1 = _time.time()
+    t0 = time.perf_counter()
+    lookup = asyncio.ensure_future(run_blocking(fetch_reestr_data, text, "cadastral"))
+    status = await update.message.reply_text("🔎 Поиск в Росреестре…")
+    if PROGRESSIVE_QUOTE_MESSAGE:
+        editor = ThrottledEditor(status.edit_text, min_interval=0)
+    data = await lookup
+    t1 = time.perf_counter()
     logger.info(f"📊 Данные из Росреестра: {data}")
     if not data or not data.get('area'):
-        await update.message.reply_text("❌ Объект не найден в Росреестре. Проверьте номер и попробуйте снова.")
+        not_found = "❌ Объект не найден в Росреестре. Проверьте номер и попробуйте снова."
+        if editor is not None:
+            await editor.flush(not_found)
+        else:
+            await update.message.reply_text(not_found)
         return
 
     area = data['area']
@@ -422,9 +568,9 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     region_code = get_region_code_from_cad(text)
 
     # Card 1: BTI using regional tariffs
-    t2 = _time.time()
+    t2 = time.perf_counter()
     bti = calc_bti(area, region_code)
-    t3 = _time.time()
+    t3 = time.perf_counter()
 
     bti_msg = (
         "🏛️ Карточка 1 — БТИ (официальные тарифы)\n\n"
@@ -443,14 +589,14 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"• Итого БТИ: {bti['total']:,.0f} ₽\n\n"
         f"Источник: Росреестр (API), поиск {t1 - t0:.2f} c, расчет {t3 - t2:.2f} c"
     )
-    await update.message.reply_text(bti_msg)
 
-    # Scene 2: Market search via SERP
-    t4 = _time.time()
-    await update.message.reply_text("🧭 Ищем рыночные цены (Avito, ЦИАН, Яндекс)…")
-    comp_list = search_competitor_prices(address, area)
+    # Scene 2: Market search via SERP — идёт, пока показывается карточка БТИ
+    t4 = time.perf_counter()
+    search = asyncio.ensure_future(run_blocking(search_competitor_prices, address, area, price_index_keys(text)))
+    await show([bti_msg], "🧭 Ищем рыночные цены (Avito, ЦИАН, Яндекс)…")
+    comp_list = await search
     comp = calc_competitors(comp_list)
-    t5 = _time.time()
+    t5 = time.perf_counter()
 
     comp_msg = (
         "🏢 Карточка 2 — Рыночные цены\n\n"
@@ -459,7 +605,8 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"• Итоговая оценка: {comp['final_price_per_m2'] * area:,.0f} ₽\n\n"
         f"Источник: SERP (Avito, ЦИАН и др.), поиск {t5 - t4:.2f} c"
     )
-    await update.message.reply_text(comp_msg)
+    if editor is None:
+        await update.message.reply_text(comp_msg)
 
     # Scene 3: Recommendation
     rec = calc_recommended(bti['total'], comp['final_price_per_m2'], area)
@@ -469,35 +616,76 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"• За м²: {rec['price']/area:,.0f} ₽/м²\n\n"
         "Обоснование: БТИ = официальные тарифы; Рынок = ориентиры конкурентов; Рекомендация = баланс двух источников."
     )
-    await update.message.reply_text(rec_msg)
 
-    # Scene 4: Commercial Proposal
-    await send_commercial_proposal(update, address, area, room_type, materials, build_year, region_code, bti['total'], comp['final_price_per_m2'] * area, rec['price'], bti['tariffs'])
+    # Scene 4: Commercial Proposal — GPT работает, пока отправляется карточка 3
+    await send_commercial_proposal(
+        update, address, area, room_type, materials, build_year, region_code, bti['total'],
+        comp['final_price_per_m2'] * area, rec['price'], bti['tariffs'],
+        announce=lambda: show(
+            [bti_msg, comp_msg, rec_msg],
+            "🧾 Коммерческое предложение — следующим сообщением" if editor is not None
+            else "🧾 Формирую коммерческое предложение…",
+            final=True
+        )
+    )
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
     logger.exception("Unhandled exception", exc_info=context.error)
 
+def build_application():
+    """PTB Application с обработчиками, без запуска; None — нет BOT_TOKEN"""
+    from telegram.ext import Application, CommandHandler, MessageHandler, filters
+    token = secrets.get('BOT_TOKEN')
+    if not token:
+        logger.error('BOT_TOKEN missing'); return None
+    bot_app = (
+        Application.builder().token(token)
+        .request(instrumented_telegram_request(connection_pool_size=TELEGRAM_POOL_SIZE))
+        .base_url(f"{TELEGRAM_API_BASE}/bot")
+        .base_file_url(f"{TELEGRAM_API_BASE}/file/bot")
+        .build()
+    )
+    bot_app.add_handler(CommandHandler("start", start))
+    bot_app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, message_handler))
+    bot_app.add_error_handler(error_handler)
+    return bot_app
+
 def init_bot():
-    global application
+    global application, update_queue
     if _background_loop is None:
         _start_background_loop()
-    token = secrets.get('BOT_TOKEN')
-    if not token:
-        logger.error('BOT_TOKEN missing'); return False
-    application = Application.builder().token(token).build()
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, message_handler))
-    application.add_error_handler(error_handler)
+    application = build_application()
+    if application is None:
+        return False
     if not getattr(application, "_initialized", False):
         _run_coro(application.initialize())
     if not getattr(application, "_running", False):
         _run_coro(application.start())
+    if WEBHOOK_ASYNC_ACK and update_queue is None:
+        update_queue = UpdateQueue(_background_loop, application.process_update)
+        update_queue.start()
     logger.info("Bot initialized and started on background loop")
     return True
 
+def health_payload() -> dict:
+    """Тело /health — общее для Flask и ASGI (asgi.py)"""
+    return {"status":"OK","message":"Bot is running","serp_cache":serp_cache.stats(),
+            "http_pool":pool_stats(),
+            "proposal_cache":proposal_cache.stats(),
+            "singleflight":singleflight_stats(),
+            "rate_limits":limiter_stats(),
+            "reestr":reestr_stats(),
+            "price_index":price_index_stats(),
+            "cadastral_snapshot":snapshot_stats(),
+            "update_queue":update_queue.stats() if update_queue is not None else None}
+
 @app.route('/health')
 def health():
-    return jsonify({"status":"OK","message":"Bot is running"})
+    return jsonify(health_payload())
+
+@app.route('/metrics')
+def metrics():
+    return Response(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 @app.route('/', methods=['POST'])
 def webhook():
@@ -507,11 +695,137 @@ def webhook():
     upd = request.get_json()
     if not upd or 'update_id' not in upd:
         return jsonify({"status":"OK"})
+    from telegram import Update
     update = Update.de_json(upd, application.bot)
-    if update:
+    if update and update_queue is not None:
+        if not update_queue.submit(update):
+            return jsonify({"error":"queue full"}), 503
+    elif update:
         _run_coro(application.process_update(update))
     return jsonify({"status":"OK"})
 
+# --- Batch portfolio quoting ---
+CADASTRAL_RE = re.compile(r'^\d{1,3}:\d{1,3}:\d{1,10}:\d{1,6}$')
+
+def _parse_batch_input(body: str, content_type: str) -> list:
+    """Кадастровые номера из CSV (колонка cadastral_number или первая) или JSONL"""
+    numbers = []
+    if 'csv' in content_type:
+        rows = list(csv.reader(io.StringIO(body)))
+        if not rows:
+            return []
+        header = [h.strip().lower() for h in rows[0]]
+        col = header.index('cadastral_number') if 'cadastral_number' in header else 0
+        if CADASTRAL_RE.match(rows[0][col].strip() if len(rows[0]) > col else ''):
+            header = None
+        for row in rows[1 if header else 0:]:
+            if len(row) > col and row[col].strip():
+                numbers.append(row[col].strip())
+        return numbers
+    for line in body.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        item = json.loads(line)
+        numbers.append(str(item.get('cadastral_number', '') if isinstance(item, dict) else item).strip())
+    return numbers
+
+def _lookup_object(cadastral_number: str) -> dict:
+    """Данные Росреестра и медиана цен конкурентов для одного объекта — вся сетевая часть расчёта"""
+    if not CADASTRAL_RE.match(cadastral_number):
+        return {"cadastral_number": cadastral_number, "status": "error", "error": "invalid cadastral number"}
+    data = lookup_reestr_data(cadastral_number, "cadastral")
+    if data is None:
+        return {"cadastral_number": cadastral_number, "status": "error", "error": "reestr unavailable"}
+    if not data.get('area'):
+        return {"cadastral_number": cadastral_number, "status": "error", "error": "object not found"}
+    area = data['area']
+    comp_list = search_competitor_prices(data.get('address') or 'Москва', area, price_index_keys(cadastral_number))
+    return {
+        "cadastral_number": cadastral_number,
+        "status": "ok",
+        "object": data,
+        "region": get_region_code_from_cad(cadastral_number),
+        "median": median_of(comp_list, 150),
+    }
+
+@timed('pricing_calc')
+def _price_objects(records: list) -> list:
+    """Три карточки для всех найденных объектов одним вызовом TARIFF_TABLE.price_portfolio;
+    результат тот же, что у calc_bti / calc_competitors / calc_recommended"""
+    ok = [r for r in records if r["status"] == "ok"]
+    if not ok:
+        return records
+    areas = [r["object"]["area"] for r in ok]
+    priced = price_portfolio(areas, [r["region"] for r in ok], [r.pop("median") for r in ok], TARIFF_TABLE)
+    bti, comp = priced["bti"], priced["competitors"]
+    for i, r in enumerate(ok):
+        r["bti"] = {
+            "measurements": bti["measurements"][i],
+            "techpassport": bti["techpassport"][i],
+            "techassignment": bti["techassignment"][i],
+            "total": bti["total"][i],
+            "tariffs": {
+                "region": r["region"],
+                "measurements_per_m2": bti["measurements_per_m2"][i],
+                "techpassport_per_m2": bti["techpassport_per_m2"][i],
+                "techassignment_per_m2": bti["techassignment_per_m2"][i],
+            },
+        }
+        r["competitors"] = {"price_per_m2": comp["price_per_m2"][i], "final_price_per_m2": comp["final_price_per_m2"][i]}
+        r["recommended"] = {"price": priced["recommended"][i]}
+    return records
+
+def quote_object(cadastral_number: str) -> dict:
+    """Полный расчёт трёх карточек для одного объекта (без Telegram)"""
+    return _price_objects([_lookup_object(cadastral_number)])[0]
+
+def _safe_lookup(cadastral_number: str) -> dict:
+    try:
+        return _lookup_object(cadastral_number)
+    except Exception as e:
+        logger.error(f"Batch quote error for {cadastral_number}: {e}")
+        return {"cadastral_number": cadastral_number, "status": "error", "error": str(e)}
+
+def _stream_batch_quotes(numbers: list):
+    """NDJSON-строки по мере готовности; в работе не больше BATCH_CONCURRENCY объектов.
+    Сетевая часть идёт в пуле, объекты, завершившиеся вместе, считаются одним колоночным вызовом"""
+    executor = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY, thread_name_prefix="batch-quote")
+    pending = set()
+    it = iter(numbers)
+    try:
+        while True:
+            for cad in it:
+                pending.add(executor.submit(_safe_lookup, cad))
+                if len(pending) >= BATCH_CONCURRENCY:
+                    break
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for record in _price_objects([fut.result() for fut in done]):
+                yield json.dumps(record, ensure_ascii=False) + "\n"
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+@app.route('/batch', methods=['POST'])
+def batch_quotes():
+    """Пакетный расчёт портфеля: CSV или JSONL с кадастровыми номерами, ответ NDJSON"""
+    token = secrets.get('BATCH_API_TOKEN') or os.getenv('BATCH_API_TOKEN')
+    if not token:
+        return jsonify({"error":"batch endpoint disabled"}), 403
+    if request.headers.get('X-Api-Token') != token:
+        return jsonify({"error":"unauthorized"}), 401
+    try:
+        numbers = _parse_batch_input(request.get_data(as_text=True), request.content_type or '')
+    except Exception as e:
+        return jsonify({"error":f"bad input: {e}"}), 400
+    if not numbers:
+        return jsonify({"error":"no cadastral numbers"}), 400
+    if len(numbers) > BATCH_MAX_OBJECTS:
+        return jsonify({"error":f"too many objects (max {BATCH_MAX_OBJECTS})"}), 413
+    logger.info(f"📦 Batch quote for {len(numbers)} objects")
+    return Response(_stream_batch_quotes(numbers), mimetype='application/x-ndjson')
+
 if __name__ == '__main__':
     port = int(os.getenv('PORT', '8080'))
     app.run(host='0.0.0.0', port=port)
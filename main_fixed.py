@@ -1,16 +1,41 @@
+from __future__ import annotations
+
 import os
 import json
+import hashlib
+import time
 import logging
 import asyncio
 import threading
 import re
-import requests
-import statistics
 from datetime import datetime
-from flask import Flask, request, jsonify
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, constants
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
-from openai import OpenAI
+from typing import TYPE_CHECKING
+from fanout import fan_out
+from offload import run_blocking
+from progressive import ThrottledEditor
+from session_store import Session, create_session_store
+from http_pool import (http_get, pool_stats, TELEGRAM_POOL_SIZE, TELEGRAM_API_BASE,
+                       SERP_API_URL, OPENAI_API_BASE)
+from price_parser import extract_prices
+from caches import get_reestr_cache, serp_cache, normalize_query, proposal_cache, proposal_fingerprint
+from update_queue import UpdateQueue, WEBHOOK_ASYNC_ACK
+from ratelimit import limiter_stats
+from reestr_client import request_reestr, reestr_stats
+from singleflight import reestr_flight, serp_query_flight, serp_search_flight, singleflight_stats
+from price_index import get_price_index, price_index_keys, price_index_stats
+from quantile_sketch import QuantileSketch, median_of
+from address_index import get_address_index, address_index_stats, normalize_address
+from cadastral_snapshot import snapshot_lookup, snapshot_stats
+from pdf_quotes import (pdf_available, get_quote_pdf, cached_file_id, remember_file_id, forget_file_id,
+                        pdf_stats, PDF_LAYOUT_VERSION)
+from metrics import (timed, record_error, record_fallback, record_duration, upstream_timer, observe,
+                     instrumented_telegram_request, render as render_metrics)
+from flask import Flask, Response, request, jsonify
+# telegram и openai импортируются при первом использовании: холодный старт
+# (Cloud Run, Yandex Cloud Functions) не платит за их загрузку
+if TYPE_CHECKING:
+    from telegram import Update
+    from telegram.ext import ContextTypes
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -19,13 +44,14 @@ logger = logging.getLogger(__name__)
 # Создаем Flask приложение
 app = Flask(__name__)
 
-# Глобальные переменные для сессий пользователей
-user_data = {}
+# Сессии пользователей (SESSION_BACKEND=memory|sqlite)
+sessions = create_session_store()
 
 # Глобальные переменные приложения и event loop
 application = None
 _background_loop = None
 _loop_thread = None
+update_queue = None  # очередь апдейтов в режиме WEBHOOK_ASYNC_ACK
 
 # Коэффициенты CRPTI (обновляются раз в полгода)
 CRPTI_COEFFICIENTS = {
@@ -34,14 +60,47 @@ CRPTI_COEFFICIENTS = {
     'last_updated': '2025-09-24'
 }
 
-# Инициализация OpenAI
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+# Клиенты OpenAI создаются при первом запросе к GPT
+_openai_client = None
+_async_openai_client = None
+_openai_lock = threading.Lock()
 
-def generate_commercial_proposal(object_data: dict, pricing_cards: dict) -> str:
-    """Генерация коммерческого предложения через GPT"""
-    try:
-        # Формируем промпт для GPT
-        prompt = f"""Ты работаешь в компании, предоставляющей услуги БТИ: обмеры помещений, подготовка технического паспорта и технического задания.
+
+def get_openai_client():
+    """Синхронный клиент OpenAI (создаётся один раз)"""
+    global _openai_client
+    if _openai_client is None:
+        with _openai_lock:
+            if _openai_client is None:
+                from openai import OpenAI
+                _openai_client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'), base_url=OPENAI_API_BASE)
+    return _openai_client
+
+
+def get_async_openai_client():
+    """Асинхронный клиент OpenAI для потоковой генерации (создаётся один раз)"""
+    global _async_openai_client
+    if _async_openai_client is None:
+        with _openai_lock:
+            if _async_openai_client is None:
+                from openai import AsyncOpenAI
+                _async_openai_client = AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY'), base_url=OPENAI_API_BASE)
+    return _async_openai_client
+
+PROPOSAL_MODEL = "gpt-3.5-turbo"
+PROPOSAL_SYSTEM_PROMPT = "Ты профессиональный менеджер по продажам услуг БТИ."
+# Потоковая выдача КП: текст появляется в Telegram по мере генерации
+PROPOSAL_STREAMING = os.getenv('PROPOSAL_STREAMING', '1') == '1'
+# Отдельная таблица индекса: здесь цены парсятся в диапазоне 50–800, в main.py — 20–500
+PRICE_INDEX_TABLE = os.getenv('PRICE_INDEX_TABLE', 'competitor_sketches_fixed')
+# Префикс ключей общих кэшей (serp_cache, proposal_cache): в main.py
+# другие параметры SERP, диапазон цен и промпт КП
+CACHE_NAMESPACE = "main_fixed"
+
+
+def _build_proposal_prompt(object_data: dict, pricing_cards: dict) -> str:
+    """Промпт для GPT по данным объекта и карточкам цен"""
+    return f"""Ты работаешь в компании, предоставляющей услуги БТИ: обмеры помещений, подготовка технического паспорта и технического задания.
 
 Составь коммерческое предложение для клиента по объекту недвижимости.
 
@@ -68,25 +127,114 @@ def generate_commercial_proposal(object_data: dict, pricing_cards: dict) -> str:
 
 Ответь только текстом коммерческого предложения без дополнительных комментариев."""
 
-        # Вызов OpenAI API (новая версия)
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "Ты профессиональный менеджер по продажам услуг БТИ."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=500,
-            temperature=0.7
-        )
+
+def _fallback_proposal(object_data: dict, pricing_cards: dict) -> str:
+    """Шаблонное КП, если GPT недоступен"""
+    return f"🤝 **КОММЕРЧЕСКОЕ ПРЕДЛОЖЕНИЕ** по объекту {object_data.get('area', 0)} м²\n\nПредлагаем выполнить полный комплекс услуг БТИ: обмеры помещений, подготовку технического паспорта и технического задания по выгодной цене **{pricing_cards.get('recommended_price', 0):,.0f} руб.**\n\nДанная стоимость учитывает рыночные цены и официальные тарифы БТИ, обеспечивая оптимальное соотношение цена-качество. Полный пакет документов будет готов в сжатые сроки с гарантией качества.\n\n📞 Свяжитесь с нами для оформления заказа!"
+
+
+def _proposal_messages(object_data: dict, pricing_cards: dict) -> list:
+    return [
+        {"role": "system", "content": PROPOSAL_SYSTEM_PROMPT},
+        {"role": "user", "content": _build_proposal_prompt(object_data, pricing_cards)}
+    ]
+
+
+def _proposal_cache_key(object_data: dict, pricing_cards: dict) -> str:
+    """Ключ в общем proposal_cache: префикс бота (у main.py свои промпт и модель) и отпечаток данных"""
+    return f"{CACHE_NAMESPACE}:{proposal_fingerprint(object_data, pricing_cards, PROPOSAL_SYSTEM_PROMPT, PROPOSAL_MODEL)}"
+
+
+def _pdf_key(object_data: dict, pricing_cards: dict, proposal: str) -> str:
+    """Отпечаток PDF: данные расчёта, хэш текста КП и версия вёрстки.
+
+    Текст КП входит в ключ: PDF с шаблонным КП (GPT недоступен) не подменяет
+    собой PDF с КП, сгенерированным позже."""
+    proposal_hash = hashlib.sha256(proposal.encode('utf-8')).hexdigest()
+    return proposal_fingerprint(object_data, pricing_cards, [proposal_hash, PDF_LAYOUT_VERSION], PROPOSAL_MODEL)
+
+
+def generate_commercial_proposal(object_data: dict, pricing_cards: dict) -> str:
+    """Генерация коммерческого предложения через GPT (с кэшем по отпечатку данных)"""
+    cache_key = _proposal_cache_key(object_data, pricing_cards)
+    cached = proposal_cache.get(cache_key)
+    if cached is not None:
+        logger.info("Proposal cache hit")
+        return cached
+    try:
+        # Вызов OpenAI API (новая версия); в gpt_call — только он, без попаданий в кэш
+        started = time.perf_counter()
+        try:
+            response = get_openai_client().chat.completions.create(
+                model=PROPOSAL_MODEL,
+                messages=_proposal_messages(object_data, pricing_cards),
+                max_tokens=500,
+                temperature=0.7
+            )
+        finally:
+            record_duration('gpt_call', time.perf_counter() - started)
         
         if response.choices:
-            return response.choices[0].message.content.strip()
+            proposal = response.choices[0].message.content.strip()
+            proposal_cache.set(cache_key, proposal)
+            return proposal
         else:
             return "Не удалось сгенерировать коммерческое предложение."
             
     except Exception as e:
         logger.error(f"Ошибка генерации коммерческого предложения: {e}")
-        return f"🤝 **КОММЕРЧЕСКОЕ ПРЕДЛОЖЕНИЕ** по объекту {object_data.get('area', 0)} м²\n\nПредлагаем выполнить полный комплекс услуг БТИ: обмеры помещений, подготовку технического паспорта и технического задания по выгодной цене **{pricing_cards.get('recommended_price', 0):,.0f} руб.**\n\nДанная стоимость учитывает рыночные цены и официальные тарифы БТИ, обеспечивая оптимальное соотношение цена-качество. Полный пакет документов будет готов в сжатые сроки с гарантией качества.\n\n📞 Свяжитесь с нами для оформления заказа!"
+        record_error('gpt_call')
+        record_fallback('gpt_call')
+        return _fallback_proposal(object_data, pricing_cards)
+
+
+async def stream_commercial_proposal(object_data: dict, pricing_cards: dict):
+    """Потоковая генерация КП: асинхронно отдаёт текст КП, накопленный к этому
+    моменту; последнее значение — итоговое КП.
+
+    Если поток оборвался, уже показанный текст остаётся превью, а последним
+    значением идёт полное КП из generate_commercial_proposal (повтор GPT или
+    шаблон) с пометкой о прерывании. Готовое КП из кэша отдаётся сразу.
+    """
+    cache_key = _proposal_cache_key(object_data, pricing_cards)
+    cached = proposal_cache.get(cache_key)
+    if cached is not None:
+        logger.info("Proposal cache hit")
+        yield cached
+        return
+    parts = []
+    try:
+        # В gpt_call — только ожидание OpenAI: правки сообщения в Telegram
+        # между фрагментами в длительность не входят
+        with upstream_timer('gpt_call') as upstream:
+            stream = await upstream.call(get_async_openai_client().chat.completions.create(
+                model=PROPOSAL_MODEL,
+                messages=_proposal_messages(object_data, pricing_cards),
+                max_tokens=500,
+                temperature=0.7,
+                stream=True
+            ))
+            async for chunk in upstream.iterate(stream):
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    yield "".join(parts)
+        if parts:
+            proposal_cache.set(cache_key, "".join(parts).strip())
+            return
+    except Exception as e:
+        logger.error(f"Ошибка потоковой генерации коммерческого предложения: {e}")
+        record_error('gpt_call')
+    if not parts:
+        record_fallback('gpt_call')
+        yield _fallback_proposal(object_data, pricing_cards)
+        return
+    # Оборванный текст не выдаётся за итоговый: КП генерируется целиком заново
+    # (и попадает в кэш, из которого его берёт PDF) или берётся шаблонное
+    proposal = await run_blocking(generate_commercial_proposal, object_data, pricing_cards)
+    yield f"{proposal}\n\n_Генерация была прервана — предложение сформировано заново._"
 
 
 def _start_background_loop():
@@ -112,38 +260,82 @@ def _run_coro(coro):
     return future.result()
 
 
+@timed('reestr_lookup')
 def fetch_reestr_data(query: str, search_type: str = "cadastral") -> dict:
-    """Шаг 1: Получение данных из Госреестра (синхронно)"""
+    """Шаг 1: Получение данных из Госреестра через дисковый TTL-кэш.
+
+    Одновременные запросы одного номера (двойное нажатие, несколько менеджеров)
+    ждут один общий запрос к API. Кадастровый номер сначала ищется в локальном
+    снимке (cadastral_snapshot) — без API и без кэша.
+    """
+    data = snapshot_lookup(query) if search_type == "cadastral" else None
+    if data is None:
+        key = f"{search_type}:{query}"
+        data = reestr_flight.do(key, lambda: _fetch_reestr_cached(key, query, search_type))
+    _remember_address(data)
+    return data
+
+
+def _remember_address(data: dict) -> None:
+    """Каждая разрешённая пара адрес → кадастр пополняет локальный индекс адресов"""
+    if not data or not data.get('address') or not data.get('cadastral_number'):
+        return
+    index = get_address_index()
+    if index is None:
+        return
+    try:
+        index.add(data['address'], str(data['cadastral_number']))
+    except Exception as e:
+        logger.warning(f"Address index update failed: {e}")
+
+
+def find_object_by_address(address: str) -> dict:
+    """Объект по адресу: локальный индекс адрес → кадастр, при промахе — поиск по адресу в API"""
+    index = get_address_index()
+    cadastral_number = index.lookup(address) if index is not None else None
+    if cadastral_number:
+        logger.info(f"Address index hit: '{address}' → {cadastral_number}")
+        return fetch_reestr_data(cadastral_number, "cadastral")
+    return fetch_reestr_data(address, "address")
+
+
+# Типы улиц после normalize_address (сокращения уже приведены к одной форме)
+_STREET_TOKENS = {'ул', 'пр', 'пер', 'ш', 'б', 'наб', 'пл', 'прд', 'аллея', 'тупик', 'линия', 'мкр', 'микрорайон'}
+
+
+def _looks_like_address(text: str) -> bool:
+    """Адрес: тип улицы и номер дома («ул. Тверская, д. 7»). Прочий текст
+    в платный поиск по адресу не уходит"""
+    tokens = normalize_address(text).split()
+    return any(t in _STREET_TOKENS for t in tokens) and any(t[0].isdigit() for t in tokens)
+
+
+def _fetch_reestr_cached(key: str, query: str, search_type: str) -> dict:
+    cache = get_reestr_cache()
+    if cache is None:
+        return _fetch_reestr_remote(query, search_type)
+    return cache.get_or_load(key, lambda: _fetch_reestr_remote(query, search_type))
+
+
+def _fetch_reestr_remote(query: str, search_type: str = "cadastral") -> dict:
+    """Запрос в Госреестр без кэша (синхронно)"""
     try:
         reestr_token = os.getenv('REESTR_API_TOKEN')
         if not reestr_token:
             logger.error("REESTR_API_TOKEN not found")
             return {}
         
-        if search_type == "cadastral":
-            url = f"https://reestr-api.ru/v1/search/cadastrFull?auth_token={reestr_token}"
-            data = {"cad_num": query}
-        else:
-            url = f"https://reestr-api.ru/v1/search/address?auth_token={reestr_token}"
-            data = {"address": query}
-        
-        response = requests.post(url, data=data, timeout=15)
-        
-        if response.status_code == 404 and search_type == "cadastral":
-            # Fallback на краткую версию поиска по кадастру
-            fallback_url = f"https://reestr-api.ru/v1/search/cadastr?auth_token={reestr_token}"
-            response = requests.post(fallback_url, data={"cad_num": query}, timeout=15)
-            if response.status_code != 200:
-                logger.warning(f"Reestr fallback HTTP {response.status_code}")
-                return {}
-        elif response.status_code != 200:
-            logger.warning(f"Reestr HTTP {response.status_code}")
+        # cadastrFull с хеджирующим запросом к краткой версии cadastr;
+        # при открытом circuit breaker сразу None, без ожидания таймаута
+        api_json = request_reestr(query, search_type, reestr_token)
+        if api_json is None:
+            logger.warning("Reestr unavailable or object not found")
+            record_error('reestr_lookup')
             return {}
         
-        api_json = response.json()
-        
     except Exception as e:
         logger.error(f"Reestr error: {e}")
+        record_error('reestr_lookup')
         return {}
 
     try:
@@ -220,13 +412,69 @@ def fetch_reestr_data(query: str, search_type: str = "cadastral") -> dict:
         logger.error(f"Reestr parse error: {e}")
         return {}
 
-def search_competitor_prices(address: str, area: float) -> list:
-    """Шаг 3: Поиск цен конкурентов через SERP API (улучшенный)"""
+def _serp_query(query: str, timeout: float, index_keys: tuple = ()) -> list:
+    """Один запрос к SERP API, возвращает распарсенные цены (с кэшем по запросу)"""
+    cache_key = f"{CACHE_NAMESPACE}:{normalize_query(query)}"
+    cached = serp_cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"SERP cache hit for query: {query}")
+        return cached
+    # Такой же запрос, уже выполняющийся в другом потоке, не дублируется
+    return serp_query_flight.do(cache_key, lambda: _serp_fetch(query, cache_key, timeout, index_keys), timeout=timeout)
+
+
+def _serp_fetch(query: str, cache_key: str, timeout: float, index_keys: tuple = ()) -> list:
+    """Запрос к SERP API без кэша; полученные цены дополняют региональный индекс"""
+    base_url = SERP_API_URL
+    params = {
+        "api_key": os.getenv('SERPRIVER_API_KEY'),
+        "system": "google",
+        "domain": "ru",
+        "query": query,
+        "result_cnt": 15,  # Увеличиваем количество результатов
+        "lr": 213  # Москва
+    }
+    
+    # В serp_query — только запрос к апстриму: попадания в кэш и ожидающие single-flight не учитываются
+    with observe('serp_query'):
+        response = http_get(base_url, timeout=min(15, timeout), params=params, upstream="serp", budget=timeout)
+    if response.status_code != 200:
+        record_error('serp_query')
+        return []
+    data = response.json()
+    results = data.get('json', {}).get('res')
+    prices = parse_competitor_prices(results) if results else []
+    serp_cache.set(cache_key, prices)
+    logger.info(f"Found {len(prices)} prices for query: {query}")
+    # Только цены, реально полученные из SERP: ответы из serp_cache
+    # и результаты ожидающих single-flight в индексе уже учтены
+    index = get_price_index(PRICE_INDEX_TABLE) if index_keys and prices else None
+    if index is not None:
+        try:
+            index.record(index_keys, QuantileSketch.from_values(prices))
+        except Exception as e:
+            logger.warning(f"Price index update failed: {e}")
+    return prices
+
+def search_competitor_prices(address: str, area: float, index_keys: tuple = ()) -> QuantileSketch:
+    """Шаг 3: Поиск цен конкурентов через SERP API (улучшенный)
+
+    index_keys — ключи регионального индекса (price_index_keys): пока запись
+    свежая и полная, цены берутся из неё без SERP; новые цены из SERP её дополняют.
+    """
     try:
+        index = get_price_index(PRICE_INDEX_TABLE) if index_keys else None
+        if index is not None:
+            indexed = index.fresh_sketch(index_keys)
+            if indexed:
+                logger.info(f"Competitor prices from regional index: {indexed.count} samples")
+                return indexed
+
         serpriver_key = os.getenv('SERPRIVER_API_KEY')
         if not serpriver_key:
             logger.warning("SERPRIVER_API_KEY not found, using default prices")
-            return [120, 150, 180, 200, 250]  # Дефолтные цены
+            record_fallback('serp_query')
+            return QuantileSketch.from_values([120, 150, 180, 200, 250])  # Дефолтные цены
         
         # Улучшенные запросы для поиска цен
         queries = [
@@ -239,44 +487,38 @@ def search_competitor_prices(address: str, area: float) -> list:
             f"замеры недвижимости {address} стоимость м²"
         ]
         
-        all_prices = []
-        
-        for query in queries:
-            try:
-                base_url = "https://serpriver.ru/api/search.php"
-                params = {
-                    "api_key": serpriver_key,
-                    "system": "google",
-                    "domain": "ru",
-                    "query": query,
-                    "result_cnt": 15,  # Увеличиваем количество результатов
-                    "lr": 213  # Москва
-                }
-                
-                response = requests.get(base_url, params=params, timeout=15)
-                if response.status_code == 200:
-                    data = response.json()
-                    if data.get('json', {}).get('res'):
-                        results = data['json']['res']
-                        prices = parse_competitor_prices(results)
-                        all_prices.extend(prices)
-                        logger.info(f"Found {len(prices)} prices for query: {query}")
-            except Exception as e:
-                logger.warning(f"Error searching competitors for query '{query}': {e}")
-                continue
+        # Тот же объект, уже считающийся в другом потоке, ждёт его fan-out
+        all_prices = serp_search_flight.do(
+            f"{CACHE_NAMESPACE}:{normalize_query(address)}|{int(area)}", lambda: _collect_serp_prices(queries, index_keys)
+        )
         
         # Если не нашли цены, используем дефолтные
-        if not all_prices:
+        if not all_prices.count:
             logger.warning("No competitor prices found, using defaults")
-            all_prices = [120, 150, 180, 200, 250]
+            record_fallback('serp_query')
+            all_prices = QuantileSketch.from_values([120, 150, 180, 200, 250])
         
-        logger.info(f"Total competitor prices found: {len(all_prices)} - {all_prices}")
+        logger.info(f"Total competitor prices found: {all_prices.count}, median: {all_prices.median()}")
         return all_prices
         
     except Exception as e:
         logger.error(f"Error in search_competitor_prices: {e}")
-        return [120, 150, 180, 200, 250]  # Дефолтные цены
+        record_error('serp_query')
+        record_fallback('serp_query')
+        return QuantileSketch.from_values([120, 150, 180, 200, 250])  # Дефолтные цены
+
+def _collect_serp_prices(queries: list, index_keys: tuple = ()) -> QuantileSketch:
+    """Параллельный опрос с общим дедлайном: по истечении бюджета
+    берём цены, которые уже успели распарсить. Цены вливаются в скетч
+    по мере прихода ответов; после compress() его безопасно делить
+    между ожидающими single-flight"""
+    all_prices = QuantileSketch()
+    for prices in fan_out(lambda q, timeout: _serp_query(q, timeout, index_keys), queries):
+        all_prices.update(prices)
+    all_prices.compress()
+    return all_prices
 
+@timed('price_parse')
 def parse_competitor_prices(results: list) -> list:
     """Улучшенный парсинг цен из результатов поиска"""
     prices = []
@@ -286,31 +528,8 @@ def parse_competitor_prices(results: list) -> list:
         title = result.get('title', '').lower()
         full_text = f"{title} {snippet}"
         
-        # Расширенные паттерны для поиска цен
-        price_patterns = [
-            r'(\d+)\s*руб[./]?\s*м[²2]',
-            r'(\d+)\s*руб[./]?\s*кв[./]?м',
-            r'(\d+)\s*руб[./]?\s*за\s*м[²2]',
-            r'от\s*(\d+)\s*руб',
-            r'(\d+)\s*руб[./]?\s*м²',
-            r'(\d+)\s*руб[./]?\s*за\s*кв[./]?м',
-            r'стоимость[:\s]*(\d+)\s*руб',
-            r'цена[:\s]*(\d+)\s*руб',
-            r'(\d+)\s*руб[./]?\s*за\s*м²',
-            r'от\s*(\d+)\s*руб[./]?\s*м²'
-        ]
-        
-        for pattern in price_patterns:
-            matches = re.findall(pattern, full_text)
-            for match in matches:
-                try:
-                    price = int(match)
-                    # Расширенный диапазон для БТИ услуг
-                    if 50 <= price <= 800:  # Разумный диапазон для БТИ
-                        prices.append(price)
-                        logger.debug(f"Found price: {price} in text: {full_text[:100]}...")
-                except ValueError:
-                    continue
+        # Один проход скомпилированным паттерном; диапазон разумный для БТИ
+        prices.extend(extract_prices(full_text, 50, 800))
     
     # Убираем дубликаты и сортируем
     unique_prices = list(set(prices))
@@ -319,6 +538,7 @@ def parse_competitor_prices(results: list) -> list:
     logger.info(f"Parsed prices: {unique_prices}")
     return unique_prices
 
+@timed('pricing_calc')
 def calculate_bti_prices(area: float) -> dict:
     """Шаг 2: Расчет карточки БТИ"""
     measurements_price = area * CRPTI_COEFFICIENTS['coefficient_measurements']
@@ -331,14 +551,21 @@ def calculate_bti_prices(area: float) -> dict:
         "total": round(total_price, 2)
     }
 
-def calculate_competitor_prices(competitor_prices: list) -> dict:
-    """Шаг 3: Расчет карточки конкурентов (улучшенный)"""
-    if not competitor_prices:
+@timed('pricing_calc')
+def calculate_competitor_prices(competitor_prices) -> dict:
+    """Шаг 3: Расчет карточки конкурентов (улучшенный)
+
+    competitor_prices — список цен или QuantileSketch. Вместо самих цен
+    в результат попадают их число и квартили: размер не зависит от выдачи.
+    """
+    sketch = competitor_prices if isinstance(competitor_prices, QuantileSketch) \
+        else QuantileSketch.from_values(competitor_prices)
+    if not sketch.count:
         logger.warning("No competitor prices, using default")
         median_price = 150  # Дефолтная цена
     else:
-        median_price = statistics.median(competitor_prices)
-        logger.info(f"Competitor prices: {competitor_prices}, median: {median_price}")
+        median_price = median_of(competitor_prices)
+        logger.info(f"Competitor prices: {sketch.count} samples, median: {median_price}")
     
     # Применяем НДС (22%) и прибыль (10%) = 1.22 * 1.10 = 1.342
     final_price = median_price * 1.342
@@ -346,9 +573,11 @@ def calculate_competitor_prices(competitor_prices: list) -> dict:
     return {
         "median_price": round(median_price, 2),
         "price": round(final_price, 2),
-        "raw_prices": competitor_prices
+        "samples": sketch.count,
+        "quartiles": [sketch.quantile(0.25), sketch.quantile(0.75)] if sketch.count else None
     }
 
+@timed('pricing_calc')
 def calculate_recommended_price(bti_total: float, competitor_price: float) -> dict:
     """Шаг 4: Расчет рекомендованной цены"""
     # Рекомендуемая цена между БТИ и конкурентами
@@ -366,57 +595,48 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start"""
     user_id = update.effective_user.id
     
-    user_data[user_id] = {
-        'step': 'waiting_cadastral',
-        'cadastral_number': None,
-        'address': None,
-        'area': None,
-        'build_year': None,
-        'materials': None,
-        'room_type': None,
-        'message_id': None,
-        'pricing_data': None  # Добавляем для хранения данных о ценах
-    }
+    sessions.save(user_id, Session())
     
     await update.message.reply_text(
         "🏠 Привет! Я бот для расчёта стоимости БТИ с тремя карточками цен.\n\n"
-        "Введите кадастровый номер (например, 77:09:0001013:1087)."
+        "Введите кадастровый номер (например, 77:09:0001013:1087) или адрес объекта."
     )
 
 async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик текстовых сообщений"""
+    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
     user_id = update.effective_user.id
     text = update.message.text
     
     logger.info(f"Message from {user_id}: '{text}'")
     
-    if user_id not in user_data:
-        user_data[user_id] = {
-            'step': 'waiting_cadastral',
-            'cadastral_number': None,
-            'address': None,
-            'area': None,
-            'build_year': None,
-            'materials': None,
-            'room_type': None,
-            'message_id': None,
-            'pricing_data': None
-        }
-    
-    current_step = user_data[user_id].get('step', 'waiting_cadastral')
+    session = sessions.get(user_id) or Session()
+    current_step = session.step or 'waiting_cadastral'
     
     if current_step == 'waiting_cadastral':
-        if re.match(r'^\d{1,3}:\d{1,3}:\d{1,10}:\d{1,6}$', text):
-            logger.info(f"🔢 Обнаружен кадастровый номер: {text}")
-            await update.message.reply_text(f"🔍 Ищу данные по кадастру {text} в Росреестре...")
+        by_cadastral = re.match(r'^\d{1,3}:\d{1,3}:\d{1,10}:\d{1,6}$', text) is not None
+        if by_cadastral or _looks_like_address(text):
+            if by_cadastral:
+                logger.info(f"🔢 Обнаружен кадастровый номер: {text}")
+                await update.message.reply_text(f"🔍 Ищу данные по кадастру {text} в Росреестре...")
+            else:
+                logger.info(f"🏠 Поиск по адресу: {text}")
+                await update.message.reply_text(f"🔍 Ищу объект по адресу «{text}»...")
             
             try:
-                # Шаг 1: Получаем данные из Госреестра (синхронно)
-                reestr_data = fetch_reestr_data(text, "cadastral")
+                # Шаг 1: Получаем данные из Госреестра (в пуле потоков, loop не блокируется);
+                # адрес сначала ищется в локальном индексе адрес → кадастр
+                if by_cadastral:
+                    reestr_data = await run_blocking(fetch_reestr_data, text, "cadastral")
+                else:
+                    reestr_data = await run_blocking(find_object_by_address, text)
                 logger.info(f"📊 Данные из Росреестра: {reestr_data}")
                 
                 if not reestr_data or not reestr_data.get('address'):
-                    await update.message.reply_text("❌ Объект не найден в Росреестре. Проверьте кадастровый номер.")
+                    await update.message.reply_text(
+                        "❌ Объект не найден в Росреестре. Проверьте кадастровый номер." if by_cadastral
+                        else "❌ Объект по адресу не найден. Уточните адрес или введите кадастровый номер."
+                    )
                     return
                 
                 if not reestr_data.get('area'):
@@ -424,8 +644,8 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     return
                 
                 # Сохраняем данные
-                user_data[user_id].update({
-                    'cadastral_number': text,
+                session.update({
+                    'cadastral_number': text if by_cadastral else reestr_data.get('cadastral_number'),
                     'address': reestr_data.get('address'),
                     'area': reestr_data.get('area'),
                     'build_year': reestr_data.get('build_year'),
@@ -436,6 +656,7 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 # Показываем найденные данные
                 message = f"""✅ **Найдены данные из Росреестра:**
 
+🔢 **Кадастровый номер:** {session.cadastral_number or 'Не указан'}
 📍 **Адрес:** {reestr_data.get('address', 'Не указан')}
 📐 **Площадь:** {reestr_data.get('area', 'Не указана')} м²
 📅 **Год постройки:** {reestr_data.get('build_year', 'Не указан')}
@@ -451,13 +672,17 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 reply_markup = InlineKeyboardMarkup(keyboard)
                 
                 sent_message = await update.message.reply_text(message, reply_markup=reply_markup, parse_mode="Markdown")
-                user_data[user_id]['message_id'] = sent_message.message_id
+                session.message_id = sent_message.message_id
+                sessions.save(user_id, session)
                 
             except Exception as e:
                 logger.error(f"Ошибка получения данных: {e}")
                 await update.message.reply_text("❌ Произошла ошибка при получении данных. Попробуйте позже.")
         else:
-            await update.message.reply_text("❓ Введите кадастровый номер или используйте /start")
+            await update.message.reply_text(
+                "❓ Введите кадастровый номер (например, 77:09:0001013:1087) "
+                "или адрес с улицей и домом (например, ул. Тверская, д. 7), или используйте /start"
+            )
     else:
         await update.message.reply_text("❓ Введите кадастровый номер или используйте /start")
 
@@ -468,22 +693,25 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
 
 async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик callback запросов"""
+    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
     query = update.callback_query
     await query.answer()
     
     user_id = query.from_user.id
     data = query.data
+    # Сессия может лежать в общем хранилище — колбэк не зависит от воркера
+    session = sessions.get(user_id) or Session()
     
     if data == "verify_yes":
         await query.edit_message_text("✅ Данные приняты. Рассчитываем три карточки цен...")
         
         try:
             # Получаем данные пользователя
-            area = user_data[user_id].get('area')
-            address = user_data[user_id].get('address')
-            build_year = user_data[user_id].get('build_year')
-            materials = user_data[user_id].get('materials')
-            room_type = user_data[user_id].get('room_type')
+            area = session.area
+            address = session.address
+            build_year = session.build_year
+            materials = session.materials
+            room_type = session.room_type
             
             if not area:
                 await query.edit_message_text("❌ Не удалось определить площадь объекта.")
@@ -493,7 +721,10 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             bti_prices = calculate_bti_prices(area)
             
             # Шаг 3: Поиск цен конкурентов
-            competitor_prices_list = search_competitor_prices(address or "Москва", area)
+            competitor_prices_list = await run_blocking(
+                search_competitor_prices, address or "Москва", area,
+                price_index_keys(session.cadastral_number or "")
+            )
             competitor_prices = calculate_competitor_prices(competitor_prices_list)
             
             # Шаг 4: Расчет рекомендованной цены
@@ -503,7 +734,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             
             # Сохраняем данные о ценах для использования в коммерческом предложении
-            user_data[user_id]['pricing_data'] = {
+            session.pricing_data = {
                 'bti_total': bti_prices['total'],
                 'bti_measurements': bti_prices['measurements'],
                 'bti_tech': bti_prices['techpassport_task'],
@@ -511,6 +742,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 'recommended_price': recommended_prices['price'],
                 'area': area
             }
+            sessions.save(user_id, session)
             
             # Шаг 5: Формируем три карточки
             message = f"""📊 **ТРИ КАРТОЧКИ ЦЕН** для {area} м² ({room_type}, {materials}, {build_year} г.):
@@ -521,7 +753,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 • **Итого БТИ: {bti_prices['total']:,.0f} руб.**
 
 🏢 **КАРТОЧКА 2: Конкуренты (рыночные цены)**
-• Медиана конкурентов: {statistics.median(competitor_prices_list) if competitor_prices_list else 150:,.0f} руб/м²
+• Медиана конкурентов: {competitor_prices['median_price']:,.0f} руб/м²
 • С НДС и прибылью: **{competitor_prices['price']:,.0f} руб.**
 
 ⭐ **КАРТОЧКА 3: Рекомендуемая цена**
@@ -547,10 +779,54 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
     elif data == "verify_no":
         await query.edit_message_text("❌ Данные отклонены. Введите кадастровый номер заново.")
-        user_data[user_id]['step'] = 'waiting_cadastral'
+        session.step = 'waiting_cadastral'
+        sessions.save(user_id, session)
     
     elif data == "download_pdf":
-        await query.edit_message_text("📄 PDF будет сгенерирован и отправлен в ближайшее время.")
+        pricing_cards = session.pricing_data or {}
+        if not pricing_cards:
+            await query.edit_message_text("❌ Данные о ценах не найдены. Сначала выполните расчет.")
+            return
+        if not pdf_available():
+            await query.message.reply_text("📄 PDF временно недоступен. Воспользуйтесь кнопкой «Коммерческое предложение».")
+            return
+        object_data = {
+            'address': session.address,
+            'area': session.area,
+            'build_year': session.build_year,
+            'materials': session.materials,
+            'room_type': session.room_type
+        }
+        # КП обычно уже в кэше (кнопка «Коммерческое предложение»); его текст входит в ключ PDF
+        proposal = await run_blocking(generate_commercial_proposal, object_data, pricing_cards)
+        pdf_key = _pdf_key(object_data, pricing_cards, proposal)
+        filename = f"BTI_{(session.cadastral_number or 'quote').replace(':', '-')}.pdf"
+        
+        # Уже загруженный документ отправляется по file_id — без вёрстки и загрузки
+        file_id = cached_file_id(pdf_key)
+        if file_id:
+            try:
+                await query.message.reply_document(document=file_id, filename=filename)
+                return
+            except Exception as e:
+                logger.warning(f"Cached PDF file_id rejected ({e}), uploading again")
+                forget_file_id(pdf_key)
+        
+        try:
+            # Вёрстка — в пуле процессов, пока Telegram показывает «отправляет файл»
+            pdf_task = asyncio.ensure_future(
+                run_blocking(get_quote_pdf, pdf_key, object_data, pricing_cards, proposal)
+            )
+            await query.message.reply_chat_action("upload_document")
+            sent = await query.message.reply_document(
+                document=await pdf_task, filename=filename,
+                caption="📄 Расчёт стоимости и коммерческое предложение"
+            )
+            if sent.document:
+                remember_file_id(pdf_key, sent.document.file_id)
+        except Exception as e:
+            logger.error(f"Ошибка формирования PDF: {e}")
+            await query.message.reply_text("❌ Не удалось сформировать PDF. Попробуйте позже.")
     
     elif data == "generate_proposal":
         await query.edit_message_text("�� Генерирую коммерческое предложение...")
@@ -558,30 +834,43 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
             # Получаем данные об объекте
             object_data = {
-                'address': user_data[user_id].get('address'),
-                'area': user_data[user_id].get('area'),
-                'build_year': user_data[user_id].get('build_year'),
-                'materials': user_data[user_id].get('materials'),
-                'room_type': user_data[user_id].get('room_type')
+                'address': session.address,
+                'area': session.area,
+                'build_year': session.build_year,
+                'materials': session.materials,
+                'room_type': session.room_type
             }
             
             # Получаем данные о ценах
-            pricing_cards = user_data[user_id].get('pricing_data', {})
+            pricing_cards = session.pricing_data or {}
             
             if not pricing_cards:
                 await query.edit_message_text("❌ Данные о ценах не найдены. Сначала выполните расчет.")
                 return
             
-            # Генерируем коммерческое предложение через GPT
-            proposal = generate_commercial_proposal(object_data, pricing_cards)
-            
-            # Отправляем коммерческое предложение
             keyboard = [
                 [InlineKeyboardButton("📞 Связаться с менеджером", callback_data="contact_manager")],
                 [InlineKeyboardButton("🔄 Новый расчёт", callback_data="new_calculation")]
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
             
+            if PROPOSAL_STREAMING:
+                # Показываем текст по мере генерации, правки не чаще TELEGRAM_EDIT_INTERVAL_SEC
+                editor = ThrottledEditor(query.edit_message_text)
+                proposal = ""
+                async for proposal in stream_commercial_proposal(object_data, pricing_cards):
+                    await editor.update(f"📝 КОММЕРЧЕСКОЕ ПРЕДЛОЖЕНИЕ\n\n{proposal} ▌")
+                await editor.flush(
+                    f"📝 **КОММЕРЧЕСКОЕ ПРЕДЛОЖЕНИЕ**\n\n{proposal.strip()}",
+                    reply_markup=reply_markup,
+                    parse_mode="Markdown"
+                )
+                return
+            
+            # Генерируем коммерческое предложение через GPT
+            proposal = await run_blocking(generate_commercial_proposal, object_data, pricing_cards)
+            
+            # Отправляем коммерческое предложение
             await query.edit_message_text(
                 f"📝 **КОММЕРЧЕСКОЕ ПРЕДЛОЖЕНИЕ**\n\n{proposal}",
                 reply_markup=reply_markup,
@@ -597,12 +886,14 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     elif data == "new_calculation":
         await query.edit_message_text("🔄 Начинаем новый расчёт. Введите кадастровый номер:")
-        user_data[user_id]['step'] = 'waiting_cadastral'
+        session.step = 'waiting_cadastral'
+        sessions.save(user_id, session)
 
 
 def initialize_bot():
     """Инициализация бота и постоянного event loop."""
-    global application
+    global application, update_queue
+    from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters
     if _background_loop is None:
         _start_background_loop()
     
@@ -612,7 +903,13 @@ def initialize_bot():
         return False
     
     try:
-        application = Application.builder().token(bot_token).build()
+        application = (
+            Application.builder().token(bot_token)
+            .request(instrumented_telegram_request(connection_pool_size=TELEGRAM_POOL_SIZE))
+            .base_url(f"{TELEGRAM_API_BASE}/bot")
+            .base_file_url(f"{TELEGRAM_API_BASE}/file/bot")
+            .build()
+        )
         application.add_handler(CommandHandler("start", start))
         application.add_handler(CallbackQueryHandler(handle_callback))
         application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, message_handler))
@@ -623,6 +920,9 @@ def initialize_bot():
             _run_coro(application.initialize())
         if not getattr(application, "_running", False):
             _run_coro(application.start())
+        if WEBHOOK_ASYNC_ACK and update_queue is None:
+            update_queue = UpdateQueue(_background_loop, application.process_update)
+            update_queue.start()
         logger.info("Bot initialized and started on background loop")
         return True
     except Exception as e:
@@ -632,7 +932,26 @@ def initialize_bot():
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({'status': 'OK', 'message': 'Bot is running'})
+    return jsonify({
+        'status': 'OK',
+        'message': 'Bot is running',
+        'serp_cache': serp_cache.stats(),
+        'http_pool': pool_stats(),
+        'proposal_cache': proposal_cache.stats(),
+        'singleflight': singleflight_stats(),
+        'rate_limits': limiter_stats(),
+        'reestr': reestr_stats(),
+        'pdf': pdf_stats(),
+        'address_index': address_index_stats(),
+        'cadastral_snapshot': snapshot_stats(),
+        'price_index': price_index_stats(PRICE_INDEX_TABLE),
+        'update_queue': update_queue.stats() if update_queue is not None else None
+    })
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Метрики этапов в формате Prometheus"""
+    return Response(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 @app.route('/', methods=['POST'])
 def webhook():
@@ -651,8 +970,13 @@ def webhook():
             return jsonify({'status': 'OK'})
         
         try:
+            from telegram import Update
             update = Update.de_json(update_data, application.bot)
-            if update:
+            if update and update_queue is not None:
+                # Быстрый ответ: обработка пойдёт в пуле обработчиков очереди
+                if not update_queue.submit(update):
+                    return jsonify({'error': 'Update queue is full'}), 503
+            elif update:
                 # Планируем обработку в постоянном loop
                 _run_coro(application.process_update(update))
                 logger.info("Update processed successfully")
@@ -698,6 +1022,7 @@ def handler(event, context):
             return {'statusCode': 200, 'body': 'OK'}
         
         try:
+            from telegram import Update
             update = Update.de_json(update_data, application.bot)
             if update:
                 # Планируем обработку в постоянном loop
@@ -0,0 +1,216 @@
+"""Метрики этапов расчёта в текстовом формате Prometheus (без внешних зависимостей).
+
+Этап — Росреестр, SERP, парсинг цен, расчёт, GPT, отправка в Telegram, вёрстка PDF.
+Для каждого этапа ведутся гистограмма длительности, счётчик ошибок и счётчик
+срабатываний fallback. Модули добавляют свои gauge и счётчики, например
+fallback hit Росреестра (ответ запасного эндпоинта cadastr). Запись — одна блокировка и bisect по границам корзин,
+поэтому на горячем пути это единицы микросекунд.
+
+Метрики живут в памяти процесса: при нескольких воркерах gunicorn каждый
+отдаёт на /metrics свои значения.
+"""
+import time
+import inspect
+import functools
+import threading
+from bisect import bisect_left
+
+# Границы корзин гистограммы, секунды: от парсинга (мс) до GPT (десятки секунд)
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 60.0)
+
+STAGES = ('reestr_lookup', 'serp_query', 'price_parse', 'pricing_calc', 'gpt_call', 'telegram_send', 'pdf_render')
+
+
+class StageMetrics:
+    """Гистограмма длительности + счётчики ошибок и fallback одного этапа."""
+
+    __slots__ = ('counts', 'total', 'count', 'errors', 'fallbacks', '_lock')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # последняя корзина — +Inf
+        self.total = 0.0
+        self.count = 0
+        self.errors = 0
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        i = bisect_left(BUCKETS, seconds)
+        with self._lock:
+            self.counts[i] += 1
+            self.total += seconds
+            self.count += 1
+
+    def snapshot(self) -> tuple:
+        with self._lock:
+            return list(self.counts), self.total, self.count, self.errors, self.fallbacks
+
+
+_stages = {name: StageMetrics() for name in STAGES}
+_stages_lock = threading.Lock()
+_gauges = []  # (имя, описание, read() -> [(labels, value)], тип: gauge или counter)
+
+
+def _stage(name: str) -> StageMetrics:
+    metrics = _stages.get(name)
+    if metrics is None:
+        with _stages_lock:
+            metrics = _stages.setdefault(name, StageMetrics())
+    return metrics
+
+
+def record_error(stage: str) -> None:
+    metrics = _stage(stage)
+    with metrics._lock:
+        metrics.errors += 1
+
+
+def record_fallback(stage: str) -> None:
+    metrics = _stage(stage)
+    with metrics._lock:
+        metrics.fallbacks += 1
+
+
+def record_duration(stage: str, seconds: float) -> None:
+    """Длительность, измеренная вызывающим (например, только ожидание апстрима)."""
+    _stage(stage).observe(seconds)
+
+
+class observe:
+    """Контекстный менеджер: длительность блока в гистограмму этапа, исключение — в ошибки.
+
+    После выхода длительность доступна в .elapsed.
+    """
+
+    __slots__ = ('metrics', 'started', 'elapsed')
+
+    def __init__(self, stage: str):
+        self.metrics = _stage(stage)
+        self.elapsed = 0.0
+
+    def __enter__(self) -> "observe":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.elapsed = time.perf_counter() - self.started
+        self.metrics.observe(self.elapsed)
+        if exc_type is not None:
+            with self.metrics._lock:
+                self.metrics.errors += 1
+
+
+class upstream_timer:
+    """Одна запись в гистограмму этапа: сумма ожиданий апстрима внутри блока.
+
+    Для потоковых ответов: call() и iterate() засчитывают только await самого
+    апстрима, паузы потребителя между фрагментами в длительность не входят.
+    Ошибки не считает — это делает вызывающий.
+    """
+
+    __slots__ = ('metrics', 'elapsed')
+
+    def __init__(self, stage: str):
+        self.metrics = _stage(stage)
+        self.elapsed = 0.0
+
+    def __enter__(self) -> "upstream_timer":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.metrics.observe(self.elapsed)
+
+    async def call(self, awaitable):
+        started = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.elapsed += time.perf_counter() - started
+
+    async def iterate(self, items):
+        items = items.__aiter__()
+        while True:
+            started = time.perf_counter()
+            try:
+                item = await items.__anext__()
+            except StopAsyncIteration:
+                return
+            finally:
+                self.elapsed += time.perf_counter() - started
+            yield item
+
+
+def timed(stage: str):
+    """Декоратор observe для функций и корутин."""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with observe(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with observe(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def register_gauge(name: str, help_text: str, read) -> None:
+    """Gauge, значение которого читается при каждом рендере /metrics."""
+    _gauges.append((name, help_text, read, "gauge"))
+
+
+def register_counter(name: str, help_text: str, read) -> None:
+    """Счётчик, который ведёт модуль-владелец; читается при каждом рендере /metrics."""
+    _gauges.append((name, help_text, read, "counter"))
+
+
+def instrumented_telegram_request(**kwargs):
+    """HTTPXRequest для Application.builder().request(): каждый вызов Bot API — этап telegram_send."""
+    from telegram.request import HTTPXRequest
+
+    class _TimedRequest(HTTPXRequest):
+        async def do_request(self, *args, **kw):
+            with observe('telegram_send'):
+                return await super().do_request(*args, **kw)
+
+    return _TimedRequest(**kwargs)
+
+
+def _format_float(value: float) -> str:
+    return repr(float(value)) if value != float('inf') else '+Inf'
+
+
+def render() -> str:
+    """Все метрики в текстовом формате Prometheus 0.0.4."""
+    lines = [
+        "# HELP bti_stage_duration_seconds Duration of quote pipeline stages.",
+        "# TYPE bti_stage_duration_seconds histogram",
+    ]
+    snapshots = {name: _stages[name].snapshot() for name in sorted(_stages)}
+    for name, (counts, total, count, _, _) in snapshots.items():
+        cumulative = 0
+        for bound, n in zip(BUCKETS + (float('inf'),), counts):
+            cumulative += n
+            lines.append(f'bti_stage_duration_seconds_bucket{{stage="{name}",le="{_format_float(bound)}"}} {cumulative}')
+        lines.append(f'bti_stage_duration_seconds_sum{{stage="{name}"}} {total!r}')
+        lines.append(f'bti_stage_duration_seconds_count{{stage="{name}"}} {count}')
+    lines += [
+        "# HELP bti_stage_errors_total Failed calls per stage.",
+        "# TYPE bti_stage_errors_total counter",
+    ]
+    lines += [f'bti_stage_errors_total{{stage="{name}"}} {snap[3]}' for name, snap in snapshots.items()]
+    lines += [
+        "# HELP bti_stage_fallbacks_total Calls answered with fallback data per stage.",
+        "# TYPE bti_stage_fallbacks_total counter",
+    ]
+    lines += [f'bti_stage_fallbacks_total{{stage="{name}"}} {snap[4]}' for name, snap in snapshots.items()]
+    for name, help_text, read, kind in _gauges:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        for labels, value in read():
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}")
+    return "\n".join(lines) + "\n"
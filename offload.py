@@ -0,0 +1,16 @@
+import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+# Пул потоков для синхронных интеграций (Росреестр, SERP, GPT), чтобы они
+# не блокировали общий event loop бота
+BLOCKING_IO_WORKERS = int(os.getenv('BLOCKING_IO_WORKERS', '32'))
+
+_executor = ThreadPoolExecutor(max_workers=BLOCKING_IO_WORKERS, thread_name_prefix="blocking-io")
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Выполняет синхронную функцию в ограниченном пуле потоков и ждёт результат."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
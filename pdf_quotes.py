@@ -0,0 +1,233 @@
+"""PDF с тремя карточками цен и коммерческим предложением.
+
+Вёрстка (reportlab) — чистая работа CPU, поэтому идёт в отдельном пуле
+процессов ограниченного размера, а не в потоках рядом с event loop бота.
+Готовые PDF кэшируются на диске по отпечатку данных расчёта, а file_id
+документа, уже загруженного в Telegram, запоминается: повторное «Скачать PDF»
+отправляет его без вёрстки и без повторной загрузки файла.
+
+reportlab — необязательная зависимость: без него pdf_available() ложно,
+и бот сообщает, что PDF недоступен.
+"""
+from __future__ import annotations
+
+import os
+import io
+import time
+import logging
+import threading
+import importlib.util
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from xml.sax.saxutils import escape
+
+from caches import SQLiteTTLCache
+from metrics import timed
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+PDF_RENDER_WORKERS = int(os.getenv('PDF_RENDER_WORKERS', '2'))
+PDF_RENDER_TIMEOUT_SEC = float(os.getenv('PDF_RENDER_TIMEOUT_SEC', '30'))
+PDF_CACHE_DIR = os.getenv('PDF_CACHE_DIR', '/tmp/bti-cache/pdf')
+PDF_CACHE_MAX_FILES = int(os.getenv('PDF_CACHE_MAX_FILES', '200'))
+# file_id живёт, пока жив бот-токен; TTL лишь ограничивает рост таблицы
+PDF_FILE_ID_TTL_SEC = float(os.getenv('PDF_FILE_ID_TTL_SEC', str(30 * 24 * 3600)))
+# Шрифт с кириллицей: в образе — пакет fonts-dejavu-core
+PDF_FONT_PATH = os.getenv('PDF_FONT_PATH', '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf')
+PDF_FONT_BOLD_PATH = os.getenv('PDF_FONT_BOLD_PATH', '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf')
+# Меняется вместе с вёрсткой, чтобы старые PDF в кэше не отдавались
+PDF_LAYOUT_VERSION = 1
+
+_pool = None
+_pool_lock = threading.Lock()
+_file_ids = None
+_file_ids_lock = threading.Lock()
+_render_flight = SingleFlight("pdf_render")
+_counters = {"rendered": 0, "disk_hits": 0, "file_id_hits": 0}
+_counters_lock = threading.Lock()
+
+
+def pdf_available() -> bool:
+    return importlib.util.find_spec('reportlab') is not None
+
+
+def _count(name: str) -> None:
+    with _counters_lock:
+        _counters[name] += 1
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn: дочерний процесс не наследует потоки и event loop бота
+                _pool = ProcessPoolExecutor(max_workers=PDF_RENDER_WORKERS,
+                                            mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+def _get_file_ids():
+    """Ленивая инициализация таблицы file_id; None, если диск недоступен."""
+    global _file_ids
+    if _file_ids is None:
+        with _file_ids_lock:
+            if _file_ids is None:
+                try:
+                    _file_ids = SQLiteTTLCache(os.path.join(PDF_CACHE_DIR, 'file_ids.sqlite3'),
+                                               PDF_FILE_ID_TTL_SEC, table="pdf_file_ids")
+                except Exception as e:
+                    logger.warning(f"PDF file_id cache disabled: {e}")
+                    return None
+    return _file_ids
+
+
+def cached_file_id(key: str) -> str | None:
+    cache = _get_file_ids()
+    cached = cache.get(key) if cache is not None else None
+    if cached is None:
+        return None
+    _count("file_id_hits")
+    return cached[0]
+
+
+def remember_file_id(key: str, file_id: str) -> None:
+    cache = _get_file_ids()
+    if cache is not None and file_id:
+        cache.set(key, file_id)
+
+
+def forget_file_id(key: str) -> None:
+    cache = _get_file_ids()
+    if cache is not None:
+        cache.delete(key)
+
+
+def _register_fonts() -> tuple:
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    if not os.path.exists(PDF_FONT_PATH):
+        logger.warning(f"PDF font {PDF_FONT_PATH} not found, Cyrillic text will not render")
+        return 'Helvetica', 'Helvetica-Bold'
+    if 'DejaVuSans' not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(TTFont('DejaVuSans', PDF_FONT_PATH))
+        bold = PDF_FONT_BOLD_PATH if os.path.exists(PDF_FONT_BOLD_PATH) else PDF_FONT_PATH
+        pdfmetrics.registerFont(TTFont('DejaVuSans-Bold', bold))
+    return 'DejaVuSans', 'DejaVuSans-Bold'
+
+
+def render_quote_pdf(object_data: dict, pricing_cards: dict, proposal: str) -> bytes:
+    """Вёрстка PDF. Выполняется в процессе пула: аргументы и результат — простые типы."""
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import ParagraphStyle
+    from reportlab.lib.units import mm
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+
+    font, bold = _register_fonts()
+    title = ParagraphStyle('title', fontName=bold, fontSize=15, leading=19, spaceAfter=6)
+    heading = ParagraphStyle('heading', fontName=bold, fontSize=12, leading=15, spaceBefore=8, spaceAfter=4)
+    body = ParagraphStyle('body', fontName=font, fontSize=10, leading=14)
+
+    def rub(value) -> str:
+        return f"{value or 0:,.0f} руб.".replace(',', ' ')
+
+    area = pricing_cards.get('area') or object_data.get('area')
+    story = [
+        Paragraph("Расчёт стоимости услуг БТИ", title),
+        Paragraph(escape(f"Адрес: {object_data.get('address') or '—'}"), body),
+        Paragraph(escape(f"Площадь: {area} м² · {object_data.get('room_type') or '—'}, "
+                         f"{object_data.get('materials') or '—'}, {object_data.get('build_year') or '—'} г."), body),
+        Spacer(1, 4 * mm),
+    ]
+    cards = Table([
+        ["Карточка", "Состав", "Сумма"],
+        ["1. БТИ (официальные тарифы)", "Обмеры", rub(pricing_cards.get('bti_measurements'))],
+        ["", "Техпаспорт + задание", rub(pricing_cards.get('bti_tech'))],
+        ["", "Итого БТИ", rub(pricing_cards.get('bti_total'))],
+        ["2. Конкуренты", "Медиана рынка с НДС и прибылью", rub(pricing_cards.get('competitor_price'))],
+        ["3. Рекомендуемая цена", "Баланс БТИ и рынка", rub(pricing_cards.get('recommended_price'))],
+    ], colWidths=[60 * mm, 70 * mm, 40 * mm])
+    cards.setStyle(TableStyle([
+        ('FONT', (0, 0), (-1, -1), font, 10),
+        ('FONT', (0, 0), (-1, 0), bold, 10),
+        ('FONT', (0, -1), (-1, -1), bold, 10),
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#e8eef7')),
+        ('ALIGN', (2, 0), (2, -1), 'RIGHT'),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ]))
+    story += [Paragraph("Три карточки цен", heading), cards]
+
+    if proposal:
+        story.append(Paragraph("Коммерческое предложение", heading))
+        for block in proposal.replace('**', '').split('\n\n'):
+            if block.strip():
+                story.append(Paragraph(escape(block.strip()).replace('\n', '<br/>'), body))
+                story.append(Spacer(1, 2 * mm))
+
+    buffer = io.BytesIO()
+    SimpleDocTemplate(buffer, pagesize=A4, leftMargin=18 * mm, rightMargin=18 * mm,
+                      topMargin=16 * mm, bottomMargin=16 * mm,
+                      title="Расчёт стоимости услуг БТИ").build(story)
+    return buffer.getvalue()
+
+
+def _cache_path(key: str) -> str:
+    return os.path.join(PDF_CACHE_DIR, f"{key}.pdf")
+
+
+def _read_cached(key: str) -> bytes | None:
+    try:
+        with open(_cache_path(key), 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _store(key: str, pdf: bytes) -> None:
+    try:
+        os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+        tmp = f"{_cache_path(key)}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(pdf)
+        os.replace(tmp, _cache_path(key))  # атомарно для других воркеров
+        files = sorted((e for e in os.scandir(PDF_CACHE_DIR) if e.name.endswith('.pdf')),
+                       key=lambda e: e.stat().st_mtime)
+        for entry in files[:max(0, len(files) - PDF_CACHE_MAX_FILES)]:
+            os.remove(entry.path)
+    except OSError as e:
+        logger.warning(f"PDF cache write error for {key}: {e}")
+
+
+@timed('pdf_render')
+def _render(key: str, object_data: dict, pricing_cards: dict, proposal: str) -> bytes:
+    started = time.perf_counter()
+    future = _get_pool().submit(render_quote_pdf, object_data, pricing_cards, proposal)
+    pdf = future.result(timeout=PDF_RENDER_TIMEOUT_SEC)
+    _count("rendered")
+    logger.info(f"PDF {key[:12]} rendered in {time.perf_counter() - started:.2f}s ({len(pdf)} bytes)")
+    _store(key, pdf)
+    return pdf
+
+
+def get_quote_pdf(key: str, object_data: dict, pricing_cards: dict, proposal: str) -> bytes:
+    """PDF из дискового кэша или свежая вёрстка в пуле процессов.
+
+    key должен зависеть от всего содержимого, включая текст proposal: кэш
+    и file_id отдаются по ключу без сравнения данных. Блокирующая: вызывать
+    через run_blocking. Одновременные запросы одного ключа ждут одну вёрстку.
+    """
+    pdf = _read_cached(key)
+    if pdf is not None:
+        _count("disk_hits")
+        return pdf
+    return _render_flight.do(key, lambda: _render(key, object_data, pricing_cards, proposal),
+                             timeout=PDF_RENDER_TIMEOUT_SEC)
+
+
+def pdf_stats() -> dict:
+    with _counters_lock:
+        counters = dict(_counters)
+    return {**counters, "available": pdf_available(), "workers": PDF_RENDER_WORKERS}
@@ -0,0 +1,171 @@
+"""Региональный индекс цен конкурентов.
+
+Запросы к SERP идут с lr=213 (Москва), поэтому цены из выдачи по сути
+региональные, а не привязаны к адресу. Индекс накапливает распарсенные цены
+(вывод parse_competitor_prices) по району (первые две части кадастрового номера)
+и региону и отдаёт их расчёту без SERP, пока запись свежая и в ней достаточно
+наблюдений. Устаревшая или «тонкая» запись дополняется живым поиском.
+
+Запись — сериализованный QuantileSketch: размер не растёт с числом цен,
+новые наблюдения вливаются merge. Хранится в SQLite (WAL) — общий файл
+для всех воркеров на инстансе.
+
+    python price_index.py [--table competitor_sketches]   # сводка по записям
+"""
+from __future__ import annotations
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from quantile_sketch import QuantileSketch
+
+logger = logging.getLogger(__name__)
+
+PRICE_INDEX_PATH = os.getenv('PRICE_INDEX_PATH', '/tmp/bti-cache/price_index.sqlite3')
+# Запись старше этого считается устаревшей и пересобирается из SERP
+PRICE_INDEX_MAX_AGE_SEC = float(os.getenv('PRICE_INDEX_MAX_AGE_SEC', str(7 * 24 * 3600)))
+# Меньше наблюдений — запись «тонкая», расчёт идёт в SERP и дополняет её
+PRICE_INDEX_MIN_SAMPLES = int(os.getenv('PRICE_INDEX_MIN_SAMPLES', '20'))
+
+
+def price_index_keys(cadastral_number: str) -> list:
+    """Ключи индекса от частного к общему: район (77:09), регион (77)."""
+    parts = (cadastral_number or '').split(':')
+    if len(parts) < 2 or not parts[0].isdigit():
+        return []
+    region = parts[0].zfill(2)
+    return [f"{region}:{parts[1]}", region]
+
+
+class PriceIndex:
+    """Скетч цен конкурентов по ключу (район / регион) с отметкой обновления."""
+
+    def __init__(self, path: str = PRICE_INDEX_PATH, table: str = "competitor_sketches",
+                 max_age: float = PRICE_INDEX_MAX_AGE_SEC, min_samples: int = PRICE_INDEX_MIN_SAMPLES):
+        self.table = table
+        self.max_age = max_age
+        self.min_samples = min_samples
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} "
+            "(key TEXT PRIMARY KEY, sketch TEXT NOT NULL, samples INTEGER NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def get(self, key: str):
+        """(скетч, возраст в секундах) или None."""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT sketch, updated_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return QuantileSketch.from_dict(json.loads(row[0])), time.time() - row[1]
+
+    def fresh_sketch(self, keys: list):
+        """Скетч первой свежей и достаточно полной записи из keys; None — нужен SERP."""
+        for key in keys:
+            entry = self.get(key)
+            if entry is None:
+                continue
+            sketch, age = entry
+            if age <= self.max_age and sketch.count >= self.min_samples:
+                with self._lock:
+                    self.hits += 1
+                return sketch
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def record(self, keys: list, sketch: QuantileSketch) -> None:
+        """Вливает скетч свежих цен во все keys; устаревшая запись начинается заново."""
+        if not sketch.count:
+            return
+        now = time.time()
+        with self._lock:
+            # BEGIN IMMEDIATE: чтение-изменение-запись атомарно и между воркерами
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for key in keys:
+                    row = self._conn.execute(
+                        f"SELECT sketch, updated_at FROM {self.table} WHERE key = ?", (key,)
+                    ).fetchone()
+                    merged = QuantileSketch(sketch.compression)
+                    if row is not None and now - row[1] <= self.max_age:
+                        merged = QuantileSketch.from_dict(json.loads(row[0]))
+                    merged.merge(sketch)
+                    self._conn.execute(
+                        f"INSERT OR REPLACE INTO {self.table} (key, sketch, samples, updated_at) VALUES (?, ?, ?, ?)",
+                        (key, json.dumps(merged.to_dict()), merged.count, now)
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def summary(self) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT key, sketch, updated_at FROM {self.table} ORDER BY key"
+            ).fetchall()
+        now = time.time()
+        return [{
+            "key": key,
+            "samples": sketch.count,
+            "p25": sketch.quantile(0.25),
+            "median": sketch.median(),
+            "p75": sketch.quantile(0.75),
+            "age_sec": round(now - updated_at),
+        } for key, sketch, updated_at in ((k, QuantileSketch.from_dict(json.loads(s)), u) for k, s, u in rows)]
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                "entries": entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 3) if total else 0.0,
+            }
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_price_index(table: str = "competitor_sketches"):
+    """Ленивая инициализация индекса; None, если диск недоступен."""
+    index = _indexes.get(table)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.get(table)
+            if index is None:
+                try:
+                    index = _indexes[table] = PriceIndex(table=table)
+                except Exception as e:
+                    logger.warning(f"Price index disabled: {e}")
+                    return None
+    return index
+
+
+def price_index_stats(table: str = "competitor_sketches") -> dict | None:
+    index = get_price_index(table)
+    return index.stats() if index is not None else None
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Сводка регионального индекса цен конкурентов")
+    parser.add_argument('--table', default='competitor_sketches')
+    args = parser.parse_args()
+    print(json.dumps(PriceIndex(table=args.table).summary(), ensure_ascii=False, indent=2))
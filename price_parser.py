@@ -0,0 +1,31 @@
+import re
+
+# Число с необязательными разделителями тысяч: "1500", "1 500", "1 500" (nbsp / узкий пробел)
+_NUMBER = r'\d{1,3}(?:[ \u00a0\u202f]\d{3})+|\d+'
+
+# Один скомпилированный паттерн вместо списка пересекающихся:
+#   "<N> руб/м²", "<N> руб. кв.м", "<N> руб за м2", "<N> руб за кв.м"
+#   "от <N> руб", "стоимость: <N> руб", "цена <N> руб"
+# Цена засчитывается, если есть префикс или единица «за м²».
+PRICE_RE = re.compile(
+    r'(?:(?<![а-яё])(?P<prefix>от|стоимость|цена)[:\s]*)?'
+    r'(?<!\d)(?P<num>' + _NUMBER + r')\s*руб'
+    r'(?:[./]?\s*(?:за\s*)?(?P<unit>м[²2]|кв[./]?\s*м))?'
+)
+_NON_DIGIT = re.compile(r'\D')
+
+
+def extract_prices(text: str, min_price: int, max_price: int) -> list:
+    """Один проход по тексту (в нижнем регистре): цены за м² в заданном диапазоне.
+
+    finditer не даёт пересекающихся совпадений, поэтому каждая позиция
+    в тексте учитывается не более одного раза.
+    """
+    prices = []
+    for m in PRICE_RE.finditer(text):
+        if not (m.group('prefix') or m.group('unit')):
+            continue
+        value = int(_NON_DIGIT.sub('', m.group('num')))
+        if min_price <= value <= max_price:
+            prices.append(value)
+    return prices
@@ -0,0 +1,105 @@
+"""Колоночный расчёт карточек цен для портфеля объектов.
+
+Повторяет скалярные calc_bti / calc_competitors / calc_recommended из main.py и
+calculate_bti_prices / calculate_competitor_prices / calculate_recommended_price
+из main_fixed.py, но принимает колонки (площади, коды регионов, цены) и считает
+их за один вызов. Порядок операций и округление совпадают со скалярными
+функциями, поэтому результаты равны бит в бит.
+"""
+from array import array
+
+
+class TariffTable:
+    """Предрасчитанная таблица тарифов: код региона -> индекс строки в колонках."""
+
+    def __init__(self, tariffs_by_region: dict, default: tuple):
+        self.default = tuple(default)
+        self.regions = dict(tariffs_by_region)
+        self._index = {}
+        self.measurements = array('d')
+        self.techpassport = array('d')
+        self.techassignment = array('d')
+        # Строка 0 — тарифы по умолчанию для неизвестных регионов
+        for region, row in [(None, self.default)] + list(self.regions.items()):
+            self._index[region] = len(self.measurements)
+            self.measurements.append(row[0])
+            self.techpassport.append(row[1])
+            self.techassignment.append(row[2])
+
+    def with_overrides(self, overrides: dict, default: tuple = None) -> "TariffTable":
+        """Новая таблица с изменёнными тарифами — для анализа «что если»."""
+        return TariffTable({**self.regions, **overrides}, default or self.default)
+
+    def rows(self, region_codes) -> list:
+        index = self._index
+        return [index.get(code, 0) for code in region_codes]
+
+
+def price_bti(areas, region_codes, table: TariffTable) -> dict:
+    """Карточка БТИ по регионам (как calc_bti) для колонок площадей и регионов."""
+    rows = table.rows(region_codes)
+    meas_col, tp_col, ta_col = table.measurements, table.techpassport, table.techassignment
+    measurements = [a * meas_col[r] for a, r in zip(areas, rows)]
+    techpassport = [a * tp_col[r] for a, r in zip(areas, rows)]
+    techassignment = [a * ta_col[r] for a, r in zip(areas, rows)]
+    total = [m + tp + ta for m, tp, ta in zip(measurements, techpassport, techassignment)]
+    return {
+        "measurements": [round(v, 2) for v in measurements],
+        "techpassport": [round(v, 2) for v in techpassport],
+        "techassignment": [round(v, 2) for v in techassignment],
+        "total": [round(v, 2) for v in total],
+        "measurements_per_m2": [meas_col[r] for r in rows],
+        "techpassport_per_m2": [tp_col[r] for r in rows],
+        "techassignment_per_m2": [ta_col[r] for r in rows],
+    }
+
+
+def price_competitors(medians) -> dict:
+    """Карточка конкурентов (как calc_competitors) по колонке медиан за м²."""
+    final = [m * 1.22 * 1.10 for m in medians]
+    return {
+        "price_per_m2": [round(m, 2) for m in medians],
+        "final_price_per_m2": [round(v, 2) for v in final],
+    }
+
+
+def price_recommended(bti_totals, comp_final_per_m2, areas) -> list:
+    """Рекомендованная цена (как calc_recommended)."""
+    return [round((b + c * a) / 2, 2) for b, c, a in zip(bti_totals, comp_final_per_m2, areas)]
+
+
+def price_portfolio(areas, region_codes, medians, table: TariffTable) -> dict:
+    """Три карточки для портфеля, с теми же округлёнными промежуточными значениями,
+    что и в message_handler (main.py)."""
+    bti = price_bti(areas, region_codes, table)
+    comp = price_competitors(medians)
+    return {
+        "bti": bti,
+        "competitors": comp,
+        "recommended": price_recommended(bti["total"], comp["final_price_per_m2"], areas),
+    }
+
+
+def price_bti_flat(areas, coefficient_measurements: float, coefficient_tech: float) -> dict:
+    """Карточка БТИ по коэффициентам CRPTI (как calculate_bti_prices в main_fixed.py)."""
+    measurements = [a * coefficient_measurements for a in areas]
+    tech = [a * coefficient_tech for a in areas]
+    return {
+        "measurements": [round(v, 2) for v in measurements],
+        "techpassport_task": [round(v, 2) for v in tech],
+        "total": [round(m + t, 2) for m, t in zip(measurements, tech)],
+    }
+
+
+def price_competitors_flat(medians) -> list:
+    """Цена конкурентов с НДС и прибылью (как calculate_competitor_prices)."""
+    return [round(m * 1.342, 2) for m in medians]
+
+
+def price_recommended_flat(bti_totals, competitor_prices) -> list:
+    """Рекомендованная цена (как calculate_recommended_price)."""
+    result = []
+    for b, c in zip(bti_totals, competitor_prices):
+        rec = (b + c) / 2
+        result.append(round(max(b * 1.05, min(rec, c * 0.95)), 2))
+    return result
@@ -0,0 +1,55 @@
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Минимальный интервал между правками одного сообщения (лимиты Telegram на edit)
+TELEGRAM_EDIT_INTERVAL_SEC = float(os.getenv('TELEGRAM_EDIT_INTERVAL_SEC', '1.0'))
+TELEGRAM_TEXT_LIMIT = 4096
+
+
+class ThrottledEditor:
+    """Правит одно сообщение Telegram по мере поступления текста, не чаще min_interval.
+
+    edit — корутина вида query.edit_message_text / message.edit_text.
+    Промежуточные правки идут без parse_mode: незакрытая разметка в середине
+    потока ломает Markdown. Финальная правка — flush().
+    """
+
+    def __init__(self, edit, min_interval: float = TELEGRAM_EDIT_INTERVAL_SEC):
+        self.edit = edit
+        self.min_interval = min_interval
+        self.edits = 0
+        self._last_text = None
+        self._last_at = 0.0
+
+    async def update(self, text: str) -> None:
+        now = time.monotonic()
+        if now - self._last_at < self.min_interval:
+            return
+        try:
+            await self._edit(text[:TELEGRAM_TEXT_LIMIT])
+        except Exception as e:
+            # Промежуточная правка не критична (например, flood control) — ждём следующую
+            logger.warning(f"Progressive edit skipped: {e}")
+        self._last_at = time.monotonic()
+
+    async def flush(self, text: str, **kwargs) -> None:
+        """Финальная правка; при ошибке разметки повторяет без parse_mode."""
+        text = text[:TELEGRAM_TEXT_LIMIT]
+        try:
+            await self._edit(text, **kwargs)
+        except Exception as e:
+            if 'parse_mode' not in kwargs:
+                raise
+            logger.warning(f"Final edit with {kwargs['parse_mode']} failed ({e}), retrying as plain text")
+            kwargs.pop('parse_mode')
+            await self._edit(text, force=True, **kwargs)
+
+    async def _edit(self, text: str, force: bool = False, **kwargs) -> None:
+        if text == self._last_text and not kwargs and not force:
+            return
+        await self.edit(text, **kwargs)
+        self.edits += 1
+        self._last_text = text
@@ -0,0 +1,161 @@
+"""Потоковый скетч квантилей (merging t-digest) для цен конкурентов.
+
+Цены добавляются по мере прихода ответов SERP; память ограничена числом
+центроидов (~compression) независимо от числа наблюдений. Скетчи сливаются
+(merge) и сериализуются в JSON, поэтому региональный индекс хранит и
+объединяет их между воркерами.
+
+Пока наблюдений не больше compression, скетч хранит их все и медиана
+совпадает со statistics.median. Дальше ошибка медианы по рангу — доли
+процента (проверяется benchmarks/bench_quantile_sketch.py).
+
+Экземпляр не потокобезопасен: заполняется в одном потоке, после compress()
+чтение квантилей ничего не меняет.
+"""
+from __future__ import annotations
+
+import math
+import statistics
+
+DEFAULT_COMPRESSION = 100
+
+
+class QuantileSketch:
+    """t-digest: отсортированные центроиды (среднее, вес) плюс буфер новых точек."""
+
+    __slots__ = ('compression', 'count', 'min', 'max', '_means', '_weights', '_buffer')
+
+    def __init__(self, compression: int = DEFAULT_COMPRESSION):
+        self.compression = compression
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self._means = []
+        self._weights = []
+        self._buffer = []  # [(значение, вес)]
+
+    @classmethod
+    def from_values(cls, values, compression: int = DEFAULT_COMPRESSION) -> "QuantileSketch":
+        sketch = cls(compression)
+        sketch.update(values)
+        return sketch
+
+    def add(self, value: float, weight: float = 1) -> None:
+        value = float(value)
+        self._buffer.append((value, weight))
+        self.count += weight
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if len(self._buffer) >= self.compression * 5:
+            self.compress()
+
+    def update(self, values) -> None:
+        for value in values:
+            self.add(value)
+
+    def merge(self, other: "QuantileSketch") -> None:
+        """Добавляет все наблюдения other (other не меняется)."""
+        if not other.count:
+            return
+        self._buffer.extend(zip(other._means, other._weights))
+        self._buffer.extend(other._buffer)
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.compress()
+
+    def _k(self, q: float) -> float:
+        return self.compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+    def _q(self, k: float) -> float:
+        return (math.sin(min(k, self.compression / 4) * 2 * math.pi / self.compression) + 1) / 2
+
+    def compress(self) -> None:
+        """Вливает буфер в центроиды; точные точки сохраняются, пока их не больше compression."""
+        if not self._buffer:
+            return
+        points = sorted(list(zip(self._means, self._weights)) + self._buffer)
+        self._buffer = []
+        if len(points) <= self.compression:
+            self._means = [m for m, _ in points]
+            self._weights = [w for _, w in points]
+            return
+        total = self.count
+        means, weights = [], []
+        cur_mean, cur_weight = points[0]
+        done = 0.0
+        limit = total * self._q(self._k(0.0) + 1)
+        for mean, weight in points[1:]:
+            if done + cur_weight + weight <= limit:
+                cur_weight += weight
+                cur_mean += (mean - cur_mean) * weight / cur_weight
+            else:
+                means.append(cur_mean)
+                weights.append(cur_weight)
+                done += cur_weight
+                limit = total * self._q(self._k(done / total) + 1)
+                cur_mean, cur_weight = mean, weight
+        means.append(cur_mean)
+        weights.append(cur_weight)
+        self._means, self._weights = means, weights
+
+    def quantile(self, q: float) -> float | None:
+        """Квантиль q ∈ [0, 1] с интерполяцией между центрами центроидов; None для пустого."""
+        if not self.count:
+            return None
+        self.compress()
+        means, weights = self._means, self._weights
+        if len(means) == 1:
+            return means[0]
+        target = q * self.count
+        # Центр центроида i — накопленный вес до него плюс половина его веса
+        center = weights[0] / 2
+        if target <= center:
+            return self.min + (means[0] - self.min) * (target / center if center else 0.0)
+        for i in range(len(means) - 1):
+            next_center = center + (weights[i] + weights[i + 1]) / 2
+            if target <= next_center:
+                frac = (target - center) / (next_center - center)
+                return means[i] + (means[i + 1] - means[i]) * frac
+            center = next_center
+        tail = self.count - center
+        frac = (target - center) / tail if tail else 1.0
+        return means[-1] + (self.max - means[-1]) * min(1.0, frac)
+
+    def median(self) -> float | None:
+        return self.quantile(0.5)
+
+    @property
+    def centroids(self) -> int:
+        return len(self._means) + len(self._buffer)
+
+    def to_dict(self) -> dict:
+        self.compress()
+        return {
+            "compression": self.compression,
+            "count": self.count,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+            "means": self._means,
+            "weights": self._weights,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "QuantileSketch":
+        sketch = cls(data.get("compression", DEFAULT_COMPRESSION))
+        if data.get("count"):
+            sketch.count = data["count"]
+            sketch.min = data["min"]
+            sketch.max = data["max"]
+            sketch._means = list(data["means"])
+            sketch._weights = list(data["weights"])
+        return sketch
+
+
+def median_of(prices, default: float | None = None) -> float | None:
+    """Медиана списка цен или скетча; default — если наблюдений нет."""
+    if isinstance(prices, QuantileSketch):
+        return prices.median() if prices.count else default
+    return statistics.median(prices) if prices else default
@@ -0,0 +1,161 @@
+import os
+import time
+import random
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+
+logger = logging.getLogger(__name__)
+
+# Квоты платных API на процесс (воркер gunicorn): при N воркерах ставьте квоту / N.
+# 0 — без ограничения темпа (повторы с backoff остаются)
+REESTR_RATE_PER_SEC = float(os.getenv('REESTR_RATE_PER_SEC', '5'))
+REESTR_BURST = int(os.getenv('REESTR_BURST', '5'))
+SERP_RATE_PER_SEC = float(os.getenv('SERP_RATE_PER_SEC', '10'))
+SERP_BURST = int(os.getenv('SERP_BURST', '10'))
+# Очередь ожидающих токен ограничена и по длине, и по времени ожидания
+UPSTREAM_MAX_QUEUE = int(os.getenv('UPSTREAM_MAX_QUEUE', '50'))
+UPSTREAM_MAX_WAIT_SEC = float(os.getenv('UPSTREAM_MAX_WAIT_SEC', '10'))
+# Повторы при 429/5xx и сетевых ошибках: экспоненциальная пауза с полным джиттером
+UPSTREAM_RETRIES = int(os.getenv('UPSTREAM_RETRIES', '3'))
+UPSTREAM_BACKOFF_BASE_SEC = float(os.getenv('UPSTREAM_BACKOFF_BASE_SEC', '0.5'))
+UPSTREAM_BACKOFF_MAX_SEC = float(os.getenv('UPSTREAM_BACKOFF_MAX_SEC', '8'))
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class UpstreamBusy(Exception):
+    """Очередь к апстриму переполнена или бюджет ожидания исчерпан — запрос не отправлен."""
+
+
+class TokenBucket:
+    """Token bucket с резервированием: вызывающий занимает будущий токен и спит до него.
+
+    Так ожидающие обслуживаются по порядку и темп не превышает rate даже под
+    нагрузкой. Если в очереди уже max_queue ожидающих или ждать дольше max_wait,
+    acquire() сразу возвращает False.
+    """
+
+    def __init__(self, rate: float, burst: int, max_queue: int = UPSTREAM_MAX_QUEUE):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_queue = max_queue
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, max_wait: float) -> tuple:
+        """(успех, сколько ждали в секундах)."""
+        if self.rate <= 0:
+            return True, 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Отрицательный остаток — число уже зарезервированных будущих токенов
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+            if wait > max_wait or -self._tokens >= self.max_queue:
+                return False, 0.0
+            self._tokens -= 1
+        if wait > 0:
+            time.sleep(wait)
+        return True, wait
+
+
+def retry_after_seconds(value) -> float | None:
+    """Retry-After в секундах: число или HTTP-дата."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+class UpstreamLimiter:
+    """Темп, повторы и ограниченная очередь для одного платного апстрима."""
+
+    def __init__(self, name: str, rate: float, burst: int, retries: int = UPSTREAM_RETRIES,
+                 backoff_base: float = UPSTREAM_BACKOFF_BASE_SEC, backoff_max: float = UPSTREAM_BACKOFF_MAX_SEC,
+                 max_queue: int = UPSTREAM_MAX_QUEUE, max_wait: float = UPSTREAM_MAX_WAIT_SEC):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst, max_queue)
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_wait = max_wait
+        self.requests = 0
+        self.retried = 0
+        self.throttled = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self._lock = threading.Lock()
+
+    def _count(self, **deltas) -> None:
+        with self._lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+
+    def _backoff(self, attempt: int, retry_after: float | None) -> float:
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def call(self, send, budget: float = None):
+        """send() -> requests.Response. Повторяет при 429/5xx и сетевых ошибках,
+        пока укладывается в budget секунд (по умолчанию max_wait)."""
+        budget = self.max_wait if budget is None else budget
+        deadline = time.monotonic() + budget
+        attempt = 0
+        while True:
+            ok, waited = self.bucket.acquire(min(self.max_wait, deadline - time.monotonic()))
+            if not ok:
+                self._count(rejected=1)
+                raise UpstreamBusy(f"{self.name}: rate limit queue is full")
+            self._count(requests=1, wait_total=waited, throttled=1 if waited > 0 else 0)
+            try:
+                response = send()
+            except OSError as e:  # исключения requests — подклассы OSError
+                response, error = None, e
+            else:
+                error = None
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+            if attempt >= self.retries:
+                if error is not None:
+                    raise error
+                return response
+            retry_after = retry_after_seconds(response.headers.get('Retry-After')) if response is not None else None
+            pause = self._backoff(attempt, retry_after)
+            if time.monotonic() + pause >= deadline:
+                if error is not None:
+                    raise error
+                return response
+            reason = error if error is not None else f"HTTP {response.status_code}"
+            logger.warning(f"{self.name}: {reason}, retry {attempt + 1}/{self.retries} in {pause:.2f}s")
+            self._count(retried=1)
+            time.sleep(pause)
+            attempt += 1
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "retried": self.retried,
+            "throttled": self.throttled,
+            "rejected": self.rejected,
+            "avg_wait_sec": round(self.wait_total / self.requests, 4) if self.requests else 0.0,
+        }
+
+
+limiters = {
+    "reestr": UpstreamLimiter("reestr", REESTR_RATE_PER_SEC, REESTR_BURST),
+    "serp": UpstreamLimiter("serp", SERP_RATE_PER_SEC, SERP_BURST),
+}
+
+
+def limiter_stats() -> dict:
+    return {name: limiter.stats() for name, limiter in limiters.items()}
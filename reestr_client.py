@@ -0,0 +1,117 @@
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http_pool import http_post, REESTR_API_BASE
+from metrics import register_counter, register_gauge
+from ratelimit import UpstreamBusy
+from resilience import CircuitBreaker, hedge, CLOSED, HALF_OPEN, OPEN
+
+logger = logging.getLogger(__name__)
+
+# Через сколько секунд без пригодного ответа cadastrFull параллельно запрашивается cadastr
+REESTR_HEDGE_DELAY_SEC = float(os.getenv('REESTR_HEDGE_DELAY_SEC', '2.0'))
+REESTR_TIMEOUT_SEC = float(os.getenv('REESTR_TIMEOUT_SEC', '15'))
+# Circuit breaker: столько сбоев подряд открывает его на REESTR_BREAKER_RESET_SEC
+REESTR_BREAKER_FAILURES = int(os.getenv('REESTR_BREAKER_FAILURES', '5'))
+REESTR_BREAKER_RESET_SEC = float(os.getenv('REESTR_BREAKER_RESET_SEC', '30'))
+
+reestr_breaker = CircuitBreaker("reestr", REESTR_BREAKER_FAILURES, REESTR_BREAKER_RESET_SEC)
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv('REESTR_HEDGE_WORKERS', '16')),
+                               thread_name_prefix="reestr-hedge")
+_counters = {"requests": 0, "hedged": 0, "backup_wins": 0}
+_counters_lock = threading.Lock()
+
+register_gauge(
+    "bti_circuit_breaker_state", "Circuit breaker state (0 closed, 1 half-open, 2 open).",
+    lambda: [({"upstream": "reestr"}, {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}[reestr_breaker.state])]
+)
+# Fallback hit: объект отдал запасной эндпоинт cadastr, а не cadastrFull
+register_counter(
+    "bti_reestr_fallback_hits_total", "Rosreestr lookups answered by the fallback cadastr endpoint.",
+    lambda: [({"endpoint": "cadastr"}, _counters["backup_wins"])]
+)
+
+
+class ReestrHTTPError(Exception):
+    def __init__(self, endpoint: str, status: int):
+        super().__init__(f"{endpoint}: HTTP {status}")
+        self.status = status
+
+
+def _count(name: str) -> None:
+    with _counters_lock:
+        _counters[name] += 1
+
+
+def _post(endpoint: str, token: str, data: dict) -> dict:
+    url = f"{REESTR_API_BASE}/v1/search/{endpoint}?auth_token={token}"
+    response = http_post(url, timeout=REESTR_TIMEOUT_SEC, data=data, upstream="reestr")
+    logger.info(f"📡 Ответ Росреестра ({endpoint}): {response.status_code}")
+    if response.status_code != 200:
+        raise ReestrHTTPError(endpoint, response.status_code)
+    return response.json()
+
+
+def _usable(api_json) -> bool:
+    """Ответ с объектом: непустой list или сам объект без обёртки list."""
+    if not isinstance(api_json, dict) or not api_json:
+        return False
+    return bool(api_json.get("list")) if "list" in api_json else True
+
+
+def request_reestr(query: str, search_type: str, token: str) -> dict | None:
+    """JSON ответа Росреестра; None — API недоступен, объект не найден ни одним эндпоинтом
+    или breaker открыт.
+
+    Поиск по кадастру хеджируется: cadastrFull сразу, cadastr — через
+    REESTR_HEDGE_DELAY_SEC (или сразу после 404), побеждает первый ответ с объектом.
+    """
+    if not reestr_breaker.allow():
+        logger.warning("Circuit reestr is open, skipping API call")
+        return None
+    _count("requests")
+    if search_type == "cadastral":
+        winner, outcomes = hedge(
+            _executor,
+            lambda: _post("cadastrFull", token, {"cad_num": query}),
+            lambda: _post("cadastr", token, {"cad_num": query}),
+            REESTR_HEDGE_DELAY_SEC, _usable
+        )
+    else:
+        try:
+            api_json = _post("address", token, {"address": query})
+            outcomes = [("primary", api_json)]
+        except Exception as e:
+            outcomes = [("primary", e)]
+        winner = outcomes[0][1] if _usable(outcomes[0][1]) else None
+
+    if any(name == "backup" for name, _ in outcomes):
+        _count("hedged")
+        if winner is not None and outcomes[-1][0] == "backup":
+            _count("backup_wins")
+    for name, result in outcomes:
+        if isinstance(result, Exception) and not isinstance(result, ReestrHTTPError):
+            logger.error(f"Reestr error ({name}): {result}")
+
+    # Провайдер жив, если хоть один эндпоинт ответил (200 или 404 «не найдено»)
+    answered = [r for _, r in outcomes if not isinstance(r, Exception)
+                or (isinstance(r, ReestrHTTPError) and r.status == 404)]
+    # Отказ локальной очереди (UpstreamBusy) о провайдере ничего не говорит
+    failed = [r for _, r in outcomes if isinstance(r, Exception) and not isinstance(r, UpstreamBusy)
+              and not (isinstance(r, ReestrHTTPError) and r.status == 404)]
+    if answered:
+        reestr_breaker.record_success()
+    elif failed:
+        reestr_breaker.record_failure()
+    else:
+        reestr_breaker.release()
+    if winner is not None:
+        return winner
+    return next((r for r in answered if isinstance(r, dict)), None)
+
+
+def reestr_stats() -> dict:
+    with _counters_lock:
+        counters = dict(_counters)
+    return {**counters, "breaker": reestr_breaker.stats()}
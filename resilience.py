@@ -0,0 +1,108 @@
+import time
+import logging
+import threading
+from concurrent.futures import wait, FIRST_COMPLETED
+
+logger = logging.getLogger(__name__)
+
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+
+
+class CircuitBreaker:
+    """Автомат closed → open → half_open → closed для одного апстрима.
+
+    После failure_threshold сбоев подряд breaker открывается: allow() сразу
+    возвращает False, и вызывающий идёт в кэш/fallback, не дожидаясь таймаута.
+    Через reset_timeout секунд пропускается один пробный вызов (half_open):
+    успех закрывает breaker, сбой открывает снова.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened = 0
+        self.short_circuited = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.short_circuited += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info(f"Circuit {self.name} closed")
+            self.state = CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.opened += 1
+                    logger.warning(f"Circuit {self.name} opened after {self.failures} failures")
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def release(self) -> None:
+        """Вызов не дошёл до апстрима (локальный отказ): счётчики не меняются,
+        пробный слот half_open освобождается для следующего вызова."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "opened": self.opened,
+                "short_circuited": self.short_circuited,
+            }
+
+
+def hedge(executor, primary, backup, delay: float, usable) -> tuple:
+    """Хеджированный вызов: primary сразу, backup — через delay секунд или сразу,
+    если primary завершился непригодным ответом.
+
+    Возвращает (победитель, исходы): победитель — первый результат, для которого
+    usable(result) истинно, иначе None; исходы — [(имя, результат или исключение)]
+    в порядке завершения. Проигравший вызов не отменяется, его результат отбрасывается.
+    """
+    started = time.monotonic()
+    pending = {executor.submit(primary): 'primary'}
+    backup_started = False
+    outcomes = []
+    while pending:
+        timeout = None if backup_started else max(0.0, delay - (time.monotonic() - started))
+        done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        for fut in done:
+            name = pending.pop(fut)
+            try:
+                result = fut.result()
+            except Exception as e:
+                outcomes.append((name, e))
+                continue
+            if usable(result):
+                return result, outcomes + [(name, result)]
+            outcomes.append((name, result))
+        if not backup_started:
+            backup_started = True
+            pending[executor.submit(backup)] = 'backup'
+    return None, outcomes
@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# memory — сессии в памяти процесса; sqlite — общий файл для всех воркеров gunicorn
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'memory')
+SESSION_DB_PATH = os.getenv('SESSION_DB_PATH', '/tmp/bti-cache/sessions.sqlite3')
+SESSION_IDLE_TTL_SEC = float(os.getenv('SESSION_IDLE_TTL_SEC', str(6 * 3600)))
+SESSION_MAX_ENTRIES = int(os.getenv('SESSION_MAX_ENTRIES', '10000'))
+
+
+class Session:
+    """Сессия пользователя: компактная запись с __slots__ вместо словаря."""
+
+    __slots__ = ('step', 'cadastral_number', 'address', 'area', 'build_year',
+                 'materials', 'room_type', 'message_id', 'pricing_data')
+
+    def __init__(self, step: str = 'waiting_cadastral', **fields):
+        self.step = step
+        for name in self.__slots__[1:]:
+            setattr(self, name, fields.get(name))
+
+    def get(self, name: str, default=None):
+        value = getattr(self, name, None)
+        return default if value is None else value
+
+    def update(self, fields: dict) -> None:
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Session":
+        return cls(**{k: v for k, v in data.items() if k in cls.__slots__})
+
+
+class MemorySessionStore:
+    """Сессии в памяти процесса: вытеснение по простою и по числу записей."""
+
+    def __init__(self, idle_ttl: float = SESSION_IDLE_TTL_SEC, max_entries: int = SESSION_MAX_ENTRIES):
+        self.idle_ttl = idle_ttl
+        self.max_entries = max_entries
+        self._data = OrderedDict()  # user_id -> (session, last_seen)
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int):
+        with self._lock:
+            entry = self._data.get(user_id)
+            if entry is None:
+                return None
+            session, last_seen = entry
+            if time.monotonic() - last_seen > self.idle_ttl:
+                del self._data[user_id]
+                return None
+            self._data[user_id] = (session, time.monotonic())
+            self._data.move_to_end(user_id)
+            return session
+
+    def save(self, user_id: int, session: Session) -> None:
+        with self._lock:
+            self._data[user_id] = (session, time.monotonic())
+            self._data.move_to_end(user_id)
+            self._evict()
+
+    def delete(self, user_id: int) -> None:
+        with self._lock:
+            self._data.pop(user_id, None)
+
+    def _evict(self) -> None:
+        deadline = time.monotonic() - self.idle_ttl
+        while self._data:
+            oldest, (_, last_seen) = next(iter(self._data.items()))
+            if len(self._data) <= self.max_entries and last_seen >= deadline:
+                break
+            del self._data[oldest]
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteSessionStore:
+    """Сессии в SQLite (WAL): файл общий для всех воркеров на инстансе.
+
+    Колбэк может прийти в воркер, который не видел исходного сообщения, —
+    сессия всё равно найдётся. Вытеснение выполняется раз в purge_every записей.
+    """
+
+    def __init__(self, path: str = SESSION_DB_PATH, idle_ttl: float = SESSION_IDLE_TTL_SEC,
+                 max_entries: int = SESSION_MAX_ENTRIES, purge_every: int = 100):
+        self.idle_ttl = idle_ttl
+        self.max_entries = max_entries
+        self.purge_every = purge_every
+        self._writes = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (user_id INTEGER PRIMARY KEY, data TEXT NOT NULL, last_seen REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_last_seen ON sessions (last_seen)")
+
+    def get(self, user_id: int):
+        with self._lock:
+            row = self._conn.execute("SELECT data, last_seen FROM sessions WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None or time.time() - row[1] > self.idle_ttl:
+            return None
+        return Session.from_dict(json.loads(row[0]))
+
+    def save(self, user_id: int, session: Session) -> None:
+        payload = json.dumps(session.to_dict(), ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (user_id, data, last_seen) VALUES (?, ?, ?)",
+                (user_id, payload, time.time())
+            )
+            self._writes += 1
+            if self._writes % self.purge_every == 0:
+                self._evict()
+
+    def delete(self, user_id: int) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+
+    def _evict(self) -> None:
+        self._conn.execute("DELETE FROM sessions WHERE last_seen < ?", (time.time() - self.idle_ttl,))
+        self._conn.execute(
+            "DELETE FROM sessions WHERE user_id IN "
+            "(SELECT user_id FROM sessions ORDER BY last_seen DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+def create_session_store():
+    """Хранилище сессий по SESSION_BACKEND; при ошибке SQLite — память процесса."""
+    if SESSION_BACKEND == 'sqlite':
+        try:
+            store = SQLiteSessionStore()
+            logger.info(f"Session store: sqlite at {SESSION_DB_PATH}")
+            return store
+        except Exception as e:
+            logger.warning(f"SQLite session store unavailable ({e}), using memory")
+    return MemorySessionStore()
@@ -0,0 +1,70 @@
+import threading
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Склейка одинаковых одновременных запросов (single-flight).
+
+    Первый вызов с ключом выполняет func, остальные вызовы с тем же ключом,
+    пришедшие до его завершения, ждут и получают тот же результат (или то же
+    исключение). Результат не кэшируется: после завершения следующий вызов
+    снова идёт в апстрим. Счётчик saved — сколько обращений к апстриму сэкономлено.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.saved = 0
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, timeout: float = None):
+        with self._lock:
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._in_flight[key] = call
+                self.calls += 1
+            else:
+                self.saved += 1
+        if not leader:
+            if not call.done.wait(timeout):
+                raise TimeoutError(f"{self.name}: in-flight call for {key!r} did not finish in {timeout}s")
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            call.done.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            in_flight = len(self._in_flight)
+        return {"upstream_calls": self.calls, "saved": self.saved, "in_flight": in_flight}
+
+
+# Росреестр по кадастровому номеру / адресу, отдельные SERP-запросы и весь
+# SERP fan-out по объекту
+reestr_flight = SingleFlight("reestr")
+serp_query_flight = SingleFlight("serp_query")
+serp_search_flight = SingleFlight("serp_search")
+
+
+def singleflight_stats() -> dict:
+    return {f.name: f.stats() for f in (reestr_flight, serp_query_flight, serp_search_flight)}
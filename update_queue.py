@@ -0,0 +1,145 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+import concurrent.futures
+
+logger = logging.getLogger(__name__)
+
+# Режим быстрого ответа вебхуку: апдейт кладётся в очередь, 200 уходит сразу
+WEBHOOK_ASYNC_ACK = os.getenv('WEBHOOK_ASYNC_ACK', '0') == '1'
+UPDATE_QUEUE_MAXSIZE = int(os.getenv('UPDATE_QUEUE_MAXSIZE', '200'))
+UPDATE_QUEUE_WORKERS = int(os.getenv('UPDATE_QUEUE_WORKERS', '16'))
+
+
+class _Handoff:
+    """Кто первым займёт передачу апдейта: loop (claim) или отказавшийся по таймауту submit (abandon)."""
+
+    __slots__ = ('_lock', '_owner')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._owner = None
+
+    def _take(self, owner: str) -> bool:
+        with self._lock:
+            if self._owner is None:
+                self._owner = owner
+            return self._owner == owner
+
+    def claim(self) -> bool:
+        return self._take('loop')
+
+    def abandon(self) -> bool:
+        return self._take('caller')
+
+
+class UpdateQueue:
+    """Ограниченная очередь апдейтов Telegram с пулом обработчиков на фоновом loop.
+
+    submit() вызывается из потока WSGI и возвращает False, если очередь полна
+    или занятый loop не принял апдейт вовремя — тогда вебхук отвечает 503
+    и Telegram повторит доставку позже.
+    В ASGI-режиме, где вебхук уже работает на том же loop, — start_async()
+    и submit_nowait().
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, process, maxsize: int = UPDATE_QUEUE_MAXSIZE,
+                 workers: int = UPDATE_QUEUE_WORKERS):
+        self.loop = loop
+        self.process = process
+        self.maxsize = maxsize
+        self.workers = workers
+        self._queue = None
+        self._tasks = []
+        self.enqueued = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        self.in_progress = 0
+        self.max_depth = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def start(self) -> None:
+        """Создаёт очередь и обработчики на фоновом loop (вызывать из другого потока)."""
+        asyncio.run_coroutine_threadsafe(self._start(), self.loop).result()
+        logger.info(f"Update queue started: maxsize={self.maxsize}, workers={self.workers}")
+
+    async def start_async(self) -> None:
+        """То же, что start(), но из корутины на самом loop."""
+        await self._start()
+        logger.info(f"Update queue started: maxsize={self.maxsize}, workers={self.workers}")
+
+    async def _start(self) -> None:
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    def submit(self, update, timeout: float = 1.0) -> bool:
+        """False — очередь полна или занятый loop не принял апдейт за timeout секунд."""
+        handoff = _Handoff()
+        future = asyncio.run_coroutine_threadsafe(self._put(update, handoff), self.loop)
+        try:
+            return future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            # future.cancel() не мешает уже запланированной корутине стартовать,
+            # поэтому отказ фиксируется флагом: брошенный апдейт loop в очередь
+            # не положит, и повтор Telegram после 503 не обработает его дважды
+            if handoff.abandon():
+                future.cancel()
+                self.rejected += 1
+                logger.warning(f"Update queue hand-off timed out after {timeout}s, rejecting update")
+                return False
+            # Постановка уже идёт на loop (put_nowait без ожиданий) — берём её исход
+            return future.result()
+
+    async def _put(self, update, handoff: "_Handoff") -> bool:
+        if not handoff.claim():
+            return False
+        return self.submit_nowait(update)
+
+    def submit_nowait(self, update) -> bool:
+        """Постановка в очередь из потока самого loop (без перехода между потоками)."""
+        try:
+            self._queue.put_nowait((time.monotonic(), update))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            logger.warning(f"Update queue full ({self.maxsize}), rejecting update")
+            return False
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+        return True
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            enqueued_at, update = await self._queue.get()
+            wait = time.monotonic() - enqueued_at
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self.in_progress += 1
+            try:
+                await self.process(update)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Update worker {index} failed: {e}")
+            finally:
+                self.in_progress -= 1
+                self._queue.task_done()
+
+    def stats(self) -> dict:
+        started = self.processed + self.failed + self.in_progress
+        return {
+            "depth": self._queue.qsize() if self._queue is not None else 0,
+            "maxsize": self.maxsize,
+            "workers": self.workers,
+            "in_progress": self.in_progress,
+            "max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "rejected": self.rejected,
+            "processed": self.processed,
+            "failed": self.failed,
+            "avg_wait_sec": round(self.total_wait / started, 4) if started else 0.0,
+            "max_wait_sec": round(self.max_wait, 4),
+        }